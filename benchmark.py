@@ -0,0 +1,243 @@
+"""
+File: benchmark.py
+
+Description:
+
+Benchmarks of the "Biased Random-Key Genetic Algorithm" on standard test functions.
+
+Sweeps the population size, key shape, elite and mutant counts, key type,
+and gradient-free versus gradient-assisted optimization, and reports for each
+configuration the generations/sec, evaluations/sec, peak memory and time-to-target.
+The results are appended to a JSON lines file, one record per configuration,
+so the performance of different versions can be compared.
+
+    python3 benchmark.py --output results.jsonl
+    python3 benchmark.py --quick --functions Sphere Rastrigin
+    python3 benchmark.py --fused
+
+See: https://en.wikipedia.org/wiki/Test_functions_for_optimization
+
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+import torch
+from brkga import BRKGA,optAdam,run
+from sphere import Sphere
+from happycat import HappyCat,box0,box2
+
+
+#===============================================================================
+# Test Functions
+#===============================================================================
+# Each function accepts a single parameter vector or a batch of parameter vectors,
+# and has its global minimum 0.
+
+def Rastrigin(x, A=10.0):
+    return A * x.shape[-1] + (x.mul(x) - A * torch.cos(2.0 * math.pi * x)).sum(-1)
+
+
+def Rosenbrock(x):
+    return (100.0 * (x[...,1:] - x[...,:-1].pow(2)).pow(2) + (1.0 - x[...,:-1]).pow(2)).sum(-1)
+
+
+def Ackley(x, a=20.0, b=0.2, c=2.0*math.pi):
+    n = x.shape[-1]
+    return (-a * torch.exp(-b * torch.sqrt(x.mul(x).sum(-1) / n))
+            - torch.exp(torch.cos(c * x).sum(-1) / n) + a + math.e)
+
+
+# The search interval of each test function.
+functions = {
+    'Sphere':       (Sphere, -50.0, 50.0),
+    'HappyCat':     (HappyCat, -2.0, 2.0),
+    'Rastrigin':    (Rastrigin, -5.12, 5.12),
+    'Rosenbrock':   (Rosenbrock, -5.0, 10.0),
+    'Ackley':       (Ackley, -32.768, 32.768),
+}
+
+dtypes = {'float64':torch.float64, 'float32':torch.float32, 'bfloat16':torch.bfloat16}
+
+
+#===============================================================================
+# Benchmark
+#===============================================================================
+
+def maxResident():
+    """
+    Return the peak resident memory of this process in bytes,
+    which 'getrusage' reports in kilobytes, except on macOS.
+    """
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def peakMemory(device, baseline=0):
+    """
+    Return the peak memory in bytes: of CUDA tensors on a CUDA device,
+    otherwise the peak resident memory of this process above 'baseline'.
+    The peak resident memory never decreases, so each configuration is measured
+    in a new process, see 'isolated'.
+    """
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    return max(0, maxResident() - baseline)
+
+
+def isolated(function, *args, **kwargs):
+    """
+    Return the result of 'function(*args, **kwargs)' called in a new process,
+    so that its peak resident memory is measured on its own.
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(function, args, kwargs)
+
+
+def benchmark(function, populationSize, keyShape, elites, mutants, keyDtype='float64', grad=False,
+                target=1.0e-3, maxTime=10.0, maxGenerations=None, device='cpu', seed=0):
+    """
+    Optimize one test function with one configuration and return a record of its performance.
+    The key shape (3,k) learns the bounds of each parameter with 'happycat.box2',
+    the key shape (k,) uses the fixed bounds of the function.
+    'peakMemory' is the peak memory above the memory in use before the configuration.
+    """
+    fun,lower,upper = functions[function]
+    bounds,decode,f = box2(fun, lower, upper) if len(keyShape) == 2 else box0(fun, lower, upper)
+    device = torch.device(device)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    # A small warm-up run loads the torch kernels before the baseline memory is measured.
+    run(BRKGA((4, *keyShape), elites=1, mutants=1, optimizer=optAdam(lr=1.0e-3), keyDtype=dtypes[keyDtype], device=device),
+        f, grad=grad, maxGenerations=2)
+    baseline = maxResident()
+    pop = BRKGA((populationSize, *keyShape), elites=elites, mutants=mutants, optimizer=optAdam(lr=1.0e-3),
+                keyDtype=dtypes[keyDtype], device=device, seed=seed)
+    state = run(pop, f, grad=grad, target=target, maxTime=maxTime, maxGenerations=maxGenerations)
+    return {
+        'function': function,
+        'populationSize': populationSize,
+        'keyShape': list(keyShape),
+        'elites': elites,
+        'mutants': mutants,
+        'keyDtype': keyDtype,
+        'grad': grad,
+        'device': str(device),
+        'generations': state.generations,
+        'evaluations': state.evaluations,
+        'elapsed': state.elapsed,
+        'generationsPerSecond': state.generations / state.elapsed,
+        'evaluationsPerSecond': state.evaluations / state.elapsed,
+        'peakMemory': peakMemory(device, baseline),
+        'bestResult': state.bestResult,
+        'target': target,
+        'timeToTarget': state.elapsed if state.reason == 'target' else None,
+        'reason': state.reason,
+    }
+
+
+def sweep(functionNames, populationSizes, keyShapes, eliteMutants, keyDtypes, grads, **kwargs):
+    """
+    Benchmark every combination of the configurations, each one in a new process, 
+    and yield their records.
+    'eliteMutants' is a list of (elites, mutants) pairs.
+    """
+    for function,size,keyShape,(elites,mutants),keyDtype,grad in itertools.product(
+            functionNames, populationSizes, keyShapes, eliteMutants, keyDtypes, grads):
+        yield isolated(benchmark, function, size, keyShape, elites, mutants, keyDtype, grad, **kwargs)
+
+
+def fusedBenchmark(function, populationSize, keyShape, elites, mutants, generations=2000, device='cpu', seed=0):
+    """
+    Measure the generations/sec of one test function and configuration with the separate
+    'evolve' and 'orderBy' steps, and with 'BRKGA.fusedStep' in eager and compiled mode,
+    and yield a record for each mode. The compile time is excluded by a warm-up step.
+    """
+    fun,lower,upper = functions[function]
+    bounds,decode,f = box2(fun, lower, upper) if len(keyShape) == 2 else box0(fun, lower, upper)
+    for mode in ['unfused', 'eager', 'compiled']:
+        pop = BRKGA((populationSize, *keyShape), elites=elites, mutants=mutants, device=device, seed=seed)
+        pop.orderBy(pop.mapBatch(f))
+        #----
+        def step():
+            if mode == 'unfused':
+                pop.evolve()
+                return pop.orderBy(pop.mapBatch(f))
+            return pop.fusedStep(f, compiled=(mode == 'compiled'))
+        #----
+        start = time.perf_counter()
+        step()
+        warmup = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(generations):
+            bestResult,_ = step()
+        elapsed = time.perf_counter() - start
+        yield {
+            'function': function,
+            'populationSize': populationSize,
+            'keyShape': list(keyShape),
+            'elites': elites,
+            'mutants': mutants,
+            'device': str(device),
+            'mode': mode,
+            'generations': generations,
+            'elapsed': elapsed,
+            'generationsPerSecond': generations / elapsed,
+            'warmup': warmup,
+            'bestResult': bestResult.item(),
+        }
+
+
+
+
+
+##===================================================
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the BRKGA on standard test functions.")
+    parser.add_argument('--output', default='benchmark.jsonl', help="JSON lines file the records are appended to")
+    parser.add_argument('--functions', nargs='+', default=list(functions), choices=list(functions))
+    parser.add_argument('--time', type=float, default=10.0, help="wall-clock seconds per configuration")
+    parser.add_argument('--target', type=float, default=1.0e-3)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--quick', action='store_true', help="a small sweep of 1 second runs")
+    parser.add_argument('--fused', action='store_true', help="eager versus compiled generations/sec on the example shapes")
+    args = parser.parse_args()
+    #----
+    if args.fused:
+        # The shapes of the 'sphere.py' and 'happycat.py' examples.
+        with open(args.output, 'a') as file:
+            for configuration in [('Sphere', 15, (100,), 2, 2), ('HappyCat', 20, (3,10), 3, 3), ('HappyCat', 50, (10,), 3, 3)]:
+                for record in fusedBenchmark(*configuration, device=args.device):
+                    file.write(json.dumps(record) + '\n')
+                    print(f"{record['function']:10s} n={record['populationSize']:<6d} keys={str(record['keyShape']):8s} "
+                          f"{record['mode']:9s} {record['generationsPerSecond']:10.1f} gen/s warmup={record['warmup']:.2f}s")
+    else:
+        if args.quick:
+            sizes,keyShapes,eliteMutants,keyDtypes,grads,maxTime = [20],[(10,),(3,10)],[(3,3)],['float64'],[False,True],1.0
+        else:
+            sizes = [20, 1000, 100000]
+            keyShapes = [(10,), (100,), (3,10)]
+            eliteMutants = [(2,2), (3,3), (10,10)]
+            keyDtypes = ['float64', 'float32']
+            grads = [False, True]
+            maxTime = args.time
+        #----
+        environment = {'torch': torch.__version__, 'python': platform.python_version(), 'machine': platform.machine(), 'started': time.time()}
+        with open(args.output, 'a') as file:
+            for record in sweep(args.functions, sizes, keyShapes, eliteMutants, keyDtypes, grads,
+                                    target=args.target, maxTime=maxTime, device=args.device):
+                record.update(environment)
+                file.write(json.dumps(record) + '\n')
+                file.flush()
+                print(f"{record['function']:10s} n={record['populationSize']:<6d} keys={str(record['keyShape']):8s} "
+                      f"e/m={record['elites']}/{record['mutants']} {record['keyDtype']:8s} grad={record['grad']!s:5s} "
+                      f"{record['generationsPerSecond']:10.1f} gen/s {record['evaluationsPerSecond']:12.1f} eval/s "
+                      f"best={record['bestResult']:.6g} ttt={record['timeToTarget']}")
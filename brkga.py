@@ -12,7 +12,20 @@ An implementation of the "Biased Random-Key Genetic Algorithm".
 
 """
 
+import asyncio
+import copy
+import csv
+import json
+import math
+import os
+import time
+import warnings
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import repeat
+
 import torch
+import torch.multiprocessing
 
 #===============================================================================
 # Wrapped Optimizers
@@ -63,21 +76,488 @@ def optRMSprop(lr=1e-2, alpha=0.99, eps=1e-8, weight_decay=0, momentum=0, center
 
 
 
+#===============================================================================
+# Random Number Streams
+#===============================================================================
+
+def childSeeds(generator, count):
+    """
+    Return a list of 'count' seeds drawn from the torch.Generator 'generator',
+    for independent and reproducible child random number streams,
+    e.g. for islands, restarts or parallel workers.
+    """
+    return torch.randint(2**62, (count,), generator=generator, device=generator.device).tolist()
+
+
+def childGenerators(generator, count, device=None):
+    """
+    Return a list of 'count' new torch.Generators on 'device',
+    seeded by 'childSeeds(generator, count)'.
+    """
+    return [torch.Generator(device or generator.device).manual_seed(seed) for seed in childSeeds(generator, count)]
+
+
+#===============================================================================
+# Evaluators
+#===============================================================================
+
+def multiprocessingContext(context=None):
+    """
+    Return a multiprocessing context for the start method name 'context'.
+    The default is 'fork' where available, which allows closures such as 
+    the 'box' decoders to be used in worker processes.
+    """
+    if context is None and 'fork' in torch.multiprocessing.get_all_start_methods():
+        context = 'fork'
+    if context is None or isinstance(context, str):
+        context = torch.multiprocessing.get_context(context)
+    return context
+
+
+def evaluate(func, keys, batched=False, chunkSize=None):
+    """
+    Compute a 1D results tensor by applying 'func' to the random 'keys'.
+    If 'batched' is False then 'func' is applied to each row of 'keys',
+    otherwise 'func' receives all rows at once, or consecutive chunks 
+    of at most 'chunkSize' rows, and returns one result per row.
+    """
+    if not batched:
+        return torch.stack([func(x) for x in keys])
+    if chunkSize is None:
+        return func(keys)
+    return torch.cat([func(x) for x in keys.split(chunkSize)])
+
+
+class SerialEvaluator():
+    """
+    Evaluate the random keys one after another in the calling thread.
+    This is the only evaluator that supports gradients through the results
+    on every backend.
+    """
+    def __call__(self, func, keys, batched=False, chunkSize=None):
+        return evaluate(func, keys, batched, chunkSize)
+    #------------------------------------------------------
+    def close(self):
+        pass
+    #------------------------------------------------------
+    def __enter__(self):
+        return self
+    #------------------------------------------------------
+    def __exit__(self, *args):
+        self.close()
+
+
+class ThreadEvaluator(SerialEvaluator):
+    """
+    Evaluate chunks of random keys concurrently in a pool of 'workers' threads.
+    The rows are split into chunks of 'chunkSize' rows, by default
+    one chunk per worker, and the results are gathered in row order.
+    Use this for objective functions that release the GIL (torch, numpy, I/O).
+    """
+    def __init__(self, workers=None, chunkSize=None):
+        self.executor = ThreadPoolExecutor(workers)
+        self.workers = self.executor._max_workers
+        self.chunkSize = chunkSize
+    #------------------------------------------------------
+    def _chunkSize(self, rows):
+        return self.chunkSize or max(1, math.ceil(rows / self.workers))
+    #------------------------------------------------------
+    def __call__(self, func, keys, batched=False, chunkSize=None):
+        chunks = keys.split(self._chunkSize(len(keys)))
+        return torch.cat(list(self.executor.map(evaluate, repeat(func), chunks, repeat(batched), repeat(chunkSize))))
+    #------------------------------------------------------
+    def close(self):
+        self.executor.shutdown()
+
+
+#----
+# Process pool worker state, set once per worker by '_initWorker'.
+_workerFunc = None
+_workerKeys = None
+
+def _initWorker(func, keys):
+    global _workerFunc,_workerKeys
+    torch.set_num_threads(1)
+    _workerFunc = func
+    _workerKeys = keys
+
+def _evaluateShared(start, stop, seed, batched, chunkSize):
+    # Each chunk has its own random number stream for stochastic objective functions,
+    # whichever worker evaluates it.
+    torch.manual_seed(seed)
+    with torch.no_grad():
+        return evaluate(_workerFunc, _workerKeys[start:stop], batched, chunkSize)
+#----
+
+
+class ProcessEvaluator(ThreadEvaluator):
+    """
+    Evaluate chunks of random keys in parallel in a pool of 'workers' processes.
+    The keys are copied into a shared memory tensor that the workers 
+    receive once when the pool starts, so each call only sends row ranges
+    to the workers and gathers their results back in row order.
+    The pool is restarted when a different objective function is evaluated.
+    The results are detached from the random keys, so this evaluator does
+    not support gradient-assisted optimization.
+    'context' is a multiprocessing context or start method name,
+    see 'multiprocessingContext'. Unless the 'fork' start method is used
+    'func' must be picklable.
+    'seed' seeds a generator of the independent torch random number streams of the chunks,
+    so that a stochastic objective function is reproducible.
+    """
+    def __init__(self, workers=None, chunkSize=None, context=None, seed=None):
+        self.context = multiprocessingContext(context)
+        self.seed = torch.randint(2**62, ()).item() if seed is None else seed
+        self.generator = torch.Generator().manual_seed(self.seed)
+        self.workers = workers or torch.multiprocessing.cpu_count()
+        self.chunkSize = chunkSize
+        self.executor = None
+        self.func = None
+        self.shared = None
+    #------------------------------------------------------
+    def _start(self, func, keys):
+        self.close()
+        self.shared = torch.empty(keys.shape, dtype=keys.dtype).share_memory_()
+        self.executor = ProcessPoolExecutor(self.workers, 
+                                            mp_context=self.context, 
+                                            initializer=_initWorker, 
+                                            initargs=(func, self.shared))
+        self.func = func
+    #------------------------------------------------------
+    def __call__(self, func, keys, batched=False, chunkSize=None):
+        rows = len(keys)
+        if (func is not self.func 
+                or self.shared.dtype != keys.dtype 
+                or self.shared.shape[1:] != keys.shape[1:] 
+                or len(self.shared) < rows):
+            self._start(func, keys)
+        self.shared[:rows].copy_(keys.detach())
+        starts = range(0, rows, self._chunkSize(rows))
+        stops = [min(rows, start + self._chunkSize(rows)) for start in starts]
+        seeds = childSeeds(self.generator, len(starts))
+        results = self.executor.map(_evaluateShared, starts, stops, seeds, repeat(batched), repeat(chunkSize))
+        return torch.cat(list(results)).to(keys.device)
+    #------------------------------------------------------
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            self.func = None
+
+
+
+#===============================================================================
+# Fitness Memo
+#===============================================================================
+
+class FitnessMemo():
+    """
+    A bounded cache of objective function values keyed by a hash of each random key,
+    with least-recently-used eviction once it holds 'maxSize' results.
+    If 'quantum' is given the random keys are rounded to multiples of 'quantum'
+    before hashing, so that nearly identical random keys share one result.
+    Pass it to the BRKGA constructor to avoid evaluating duplicate random keys again
+    in 'BRKGA.map' and 'BRKGA.mapBatch': a duplicate reuses the cached result,
+    or if 'mutate' is True it is replaced by a new random key that is evaluated instead.
+    Each looked up random key counts once in 'self.hits' or 'self.misses',
+    and the replaced random keys are counted in 'self.mutations'.
+    """
+    def __init__(self, maxSize=100000, quantum=None, mutate=False):
+        self.maxSize = maxSize
+        self.quantum = quantum
+        self.mutate = mutate
+        self.table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.mutations = 0
+        self._multipliers = None
+    #------------------------------------------------------
+    def hashes(self, keys):
+        """
+        Return a 1D int64 tensor with the hash of each row of the random 'keys'.
+        """
+        keys = keys.detach().flatten(1)
+        if self.quantum is None:
+            codes = keys.to(torch.float64).view(torch.int64)
+        else:
+            codes = keys.div(self.quantum).round_().to(torch.int64)
+        if self._multipliers is None or len(self._multipliers) != codes.shape[1]:
+            generator = torch.Generator().manual_seed(0)
+            self._multipliers = torch.randint(2**62, (codes.shape[1],), generator=generator).mul_(2).add_(1)
+        codes = codes ^ (codes >> 29)
+        return codes.mul_(self._multipliers.to(codes.device)).sum(1)
+    #------------------------------------------------------
+    def lookup(self, hashes):
+        """
+        Return a boolean tensor of the 'hashes' found in the memo,
+        and a float64 tensor of their results, with NaN for the others.
+        """
+        results = []
+        for h in hashes.tolist():
+            result = self.table.get(h)
+            if result is not None:
+                self.table.move_to_end(h)
+            results.append(result)
+        found = torch.tensor([result is not None for result in results], dtype=torch.bool)
+        values = torch.tensor([math.nan if result is None else result for result in results], dtype=torch.float64)
+        self.hits += int(found.sum())
+        self.misses += len(results) - int(found.sum())
+        return found.to(hashes.device),values.to(hashes.device)
+    #------------------------------------------------------
+    def contains(self, hashes):
+        """
+        Return a boolean tensor of the 'hashes' found in the memo,
+        without counting them as hits or misses.
+        """
+        return torch.tensor([h in self.table for h in hashes.tolist()], dtype=torch.bool, device=hashes.device)
+    #------------------------------------------------------
+    def store(self, hashes, values):
+        """
+        Store the results 'values' of the random keys with the 'hashes',
+        evicting the least recently used results beyond 'self.maxSize'.
+        """
+        for h,value in zip(hashes.tolist(), values.detach().tolist()):
+            self.table[h] = value
+            self.table.move_to_end(h)
+        while len(self.table) > self.maxSize:
+            self.table.popitem(last=False)
+    #------------------------------------------------------
+    def clear(self):
+        self.table.clear()
+    #------------------------------------------------------
+    def __len__(self):
+        return len(self.table)
+
+
+
+#===============================================================================
+# Surrogates
+#===============================================================================
+
+def rankCorrelation(a, b):
+    """
+    Return the Spearman rank correlation of the 1D tensors 'a' and 'b'.
+    """
+    a = a.argsort().argsort().to(torch.float64)
+    b = b.argsort().argsort().to(torch.float64)
+    a -= a.mean()
+    b -= b.mean()
+    return (a.dot(b) / (a.norm() * b.norm()).clamp(min=1.0e-12)).item()
+
+
+class Surrogate():
+    """
+    A cheap model of the objective function: the inverse distance weighted mean of the
+    results of the 'neighbours' nearest random keys in a history of the last 'history'
+    evaluated random keys and their results.
+    Pass it to the BRKGA constructor to pre-screen the dirty rows in 'BRKGA.map' and 
+    'BRKGA.mapBatch': only the most promising 'fraction' of them, by their predicted results,
+    and those predicted to be as good as the worst elite, are evaluated by the objective function.
+    The other rows get their predicted results, marked as estimated, if 'estimate' is True,
+    otherwise they are discarded with the worst possible result.
+    'self.accuracy' is the list of the rank correlations of the predicted and the true
+    results of each evaluated batch, predicted before the batch is added to the history,
+    over the random keys that are not already in the history; 'self.repeats' is the list
+    of the number of random keys of each batch that are already in the history.
+    """
+    def __init__(self, fraction=0.25, neighbours=8, history=10000, estimate=True):
+        self.fraction = fraction
+        self.neighbours = neighbours
+        self.history = history
+        self.estimate = estimate
+        self.keys = None
+        self.values = None
+        self.size = 0
+        self.next = 0
+        self.accuracy = []
+        self.repeats = []
+    #------------------------------------------------------
+    @property
+    def ready(self):
+        return self.size >= self.neighbours
+    #------------------------------------------------------
+    def predict(self, keys):
+        """
+        Return the predicted results of the random 'keys'.
+        PRECONDITION: self.ready
+        """
+        return self._predict(keys)[0]
+    #------------------------------------------------------
+    def _predict(self, keys):
+        """
+        Return the predicted results of the random 'keys', and the distance of each one
+        to its nearest random key in the history.
+        """
+        keys = keys.detach().flatten(1).to(self.keys)
+        distances,nearest = torch.cdist(keys, self.keys[:self.size]).topk(min(self.neighbours, self.size), largest=False)
+        nearestDistances = distances[:,0].clone()
+        weights = distances.clamp_(min=1.0e-12).reciprocal_()
+        return (self.values[nearest] * weights).sum(1) / weights.sum(1),nearestDistances
+    #------------------------------------------------------
+    def observe(self, keys, values):
+        """
+        Add the random 'keys' and their true result 'values' to the history,
+        replacing the oldest ones beyond 'self.history'.
+        """
+        keys = keys.detach().flatten(1).to(torch.float64)[-self.history:]
+        values = values.detach().to(torch.float64)[-self.history:]
+        if self.ready:
+            predictions,distances = self._predict(keys)
+            novel = distances > 0
+            self.repeats.append(len(keys) - int(novel.sum()))
+            # The rank correlation of two results is always +/-1.
+            if novel.sum() > 2:
+                self.accuracy.append(rankCorrelation(predictions[novel], values[novel]))
+        if self.keys is None:
+            self.keys = torch.empty((self.history, keys.shape[1]), dtype=torch.float64, device=keys.device)
+            self.values = torch.empty(self.history, dtype=torch.float64, device=keys.device)
+        slots = torch.arange(self.next, self.next + len(keys), device=keys.device).remainder_(self.history)
+        self.keys[slots] = keys
+        self.values[slots] = values
+        self.next = (self.next + len(keys)) % self.history
+        self.size = min(self.size + len(keys), self.history)
+    #------------------------------------------------------
+    def clear(self):
+        self.size = 0
+        self.next = 0
+        self.accuracy = []
+        self.repeats = []
+
+
+
 #===============================================================================
 
 
 
 
 class BRKGA():
-    def __init__(self, populationShape, elites=1, mutants=1, optimizer=optSGD(), dtype=torch.float64):
+    """
+    A population of random keys with shape 'populationShape' = (population size, *keyShape).
+    'elites' is the number of best random keys that are kept unchanged in each generation.
+    'mutants' is the number of worst random keys that are replaced by new random keys 
+    in the pool of non-elite parents.
+    'bias' is the probability that an offspring inherits a key from its elite parent,
+    called rho in [1], where values of 0.6 to 0.8 are typical.
+    'parents' is the number of parents of each offspring, of which 'eliteParents' are
+    drawn from the elites and the others from the non-elites, with at least one of each. The elite parents share 
+    the inheritance probability 'bias', and the non-elite parents share '1 - bias'.
+    'metrics' is an optional 'Metrics' instance that records the timings and statistics
+    of each generation.
+    'device' is the device of the random keys and of all the tensors of the population.
+    'keyDtype' is the storage type of the random keys, by default 'dtype'.
+    A compact 'keyDtype' such as torch.float32 or torch.bfloat16 reduces the memory
+    of large populations, while the objective function still receives random keys 
+    converted to 'dtype', and the results are kept in 'dtype'.
+    'blockSize' is the number of rows that 'self.evolve', 'self.map' and 'self.mapBatch'
+    process at a time, by default the whole population, which bounds their scratch memory.
+    'storage' is an optional directory where the random keys, the next population
+    and the cached results are kept in memory-mapped files, for populations that
+    do not fit in memory. Use it with a 'blockSize' and on the CPU device.
+    'generator' is the torch.Generator of every random draw of the population,
+    by default a new generator seeded with 'seed', or with a seed drawn from 
+    the global torch random number generator if 'seed' is None.
+    See 'childSeeds' and 'childGenerators' to derive independent streams from it.
+    'memo' is an optional 'FitnessMemo' of the results of 'self.map' and 'self.mapBatch',
+    so that duplicate random keys are not evaluated again.
+    'surrogate' is an optional 'Surrogate' model of the objective function that 
+    pre-screens the rows evaluated by 'self.map' and 'self.mapBatch'.
+    """
+    def __init__(self, populationShape, elites=1, mutants=1, optimizer=optSGD(), dtype=torch.float64, evaluator=None,
+                    bias=0.5, parents=2, eliteParents=1, metrics=None, device=None, keyDtype=None,
+                    blockSize=None, storage=None, seed=None, generator=None, memo=None, surrogate=None):
         super().__init__()
+        if not 0.0 < bias < 1.0:
+            raise ValueError(f"bias must be in the interval (0,1): {bias}")
+        if not 1 <= eliteParents < parents:
+            raise ValueError(f"need 1 <= eliteParents < parents: {parents},{eliteParents}")
+        self.bias = bias
+        self.parentCount = parents
+        self.eliteParentCount = eliteParents
         self.dtype = dtype
-        self.keys = torch.rand(*populationShape, requires_grad=True, dtype=dtype)
+        self.keyDtype = dtype if keyDtype is None else keyDtype
+        self.device = torch.device('cpu') if device is None else torch.device(device)
+        self.evaluator = SerialEvaluator() if evaluator is None else evaluator
+        self.metrics = metrics
+        self.memo = memo
+        self.surrogate = surrogate
+        self.storage = storage
+        if storage is not None:
+            os.makedirs(storage, exist_ok=True)
+        if generator is None:
+            generator = torch.Generator(self.device)
+            generator.manual_seed(torch.randint(2**62, ()).item() if seed is None else seed)
+        self.generator = generator
+        self.keys = self._tensor('keys', populationShape, self.keyDtype).uniform_(generator=self.generator).requires_grad_()
         self.indexes = None
-        self.eliteCount = max(1, elites)
-        self.mutantCount = max(0, mutants)
+        self.descending = False
+        self.generation = 0
+        self.evaluations = 0
+        self.failures = 0
+        self.intensifyStep = None
+        self._fused = None
+        self.eliteCount = min(max(1, elites), len(self.keys))
+        self.mutantCount = min(max(0, mutants), len(self.keys) - self.eliteCount)
         self.nonMutantCount = len(self.keys) - self.mutantCount
+        self.blockSize = None if blockSize is None else max(1, blockSize)
         self.optimizer = optimizer([self.keys])
+        #----
+        # Cached objective function values, one per row in 'self.keys'.
+        # A row is 'dirty' when its random key changed since it was last evaluated.
+        self.fitness = self._tensor('fitness', (len(self.keys),), dtype)
+        self.dirty = torch.ones(len(self.keys), dtype=torch.bool, device=self.device)
+        self.fitnessFunc = None
+        # A row is 'estimated' when its cached result is an estimate, see 'self.gradientStep'.
+        self.estimated = torch.zeros(len(self.keys), dtype=torch.bool, device=self.device)
+        #----
+        self._allocateBuffers()
+    #------------------------------------------------------
+    def _tensor(self, name, shape, dtype):
+        """
+        Return a new uninitialized tensor for the population,
+        in the memory-mapped file 'name' if the population has a 'storage' directory.
+        """
+        if self.storage is None:
+            return torch.empty(shape, dtype=dtype, device=self.device)
+        size = math.prod(shape)
+        return torch.from_file(os.path.join(self.storage, f"{name}.bin"), shared=True, size=size, dtype=dtype).view(shape)
+    #------------------------------------------------------
+    def _allocateBuffers(self):
+        """
+        Allocate the scratch tensors used by 'self.evolve' and 'self.optimize',
+        so that a generation step does not allocate any new tensors.
+        The crossover buffers hold one block of 'self.blockSize' offspring.
+        """
+        keys = self.keys.detach()
+        keyShape = keys.shape[1:]
+        blockSize = max(1, len(keys) - self.eliteCount)
+        if self.blockSize is not None:
+            blockSize = min(self.blockSize, blockSize)
+        #----
+        # The next population, swapped with the storage of 'self.keys' by 'self.evolve'.
+        self._spare = self._tensor('spare', keys.shape, keys.dtype)
+        self._poolRows = torch.empty(blockSize, dtype=torch.long, device=keys.device)
+        self._eliteSelectors = torch.empty(blockSize, dtype=torch.long, device=keys.device)
+        self._nonEliteSelectors = torch.empty(blockSize, dtype=torch.long, device=keys.device)
+        self._uniform = torch.empty((blockSize, *keyShape), dtype=keys.dtype, device=keys.device)
+        if self.parentCount == 2 and self.eliteParentCount == 1:
+            self._selectedElites = torch.empty_like(self._uniform)
+            self._selectedNonElites = torch.empty_like(self._uniform)
+            self._inherit = torch.empty(self._uniform.shape, dtype=torch.bool, device=keys.device)
+        else:
+            # Multi-parent crossover: each key is inherited from one of the parents
+            # with the probabilities given by the cumulative 'self._inheritance'.
+            nonEliteParents = self.parentCount - self.eliteParentCount
+            weights = [self.bias / self.eliteParentCount] * self.eliteParentCount
+            weights += [(1.0 - self.bias) / nonEliteParents] * nonEliteParents
+            self._inheritance = torch.tensor(weights, dtype=keys.dtype, device=keys.device).div_(sum(weights)).cumsum_(0)
+            self._parentSelectors = torch.empty((self.parentCount, blockSize), dtype=torch.long, device=keys.device)
+            self._parents = torch.empty((self.parentCount, blockSize, *keyShape), dtype=keys.dtype, device=keys.device)
+            self._choice = torch.empty(self._uniform.shape, dtype=torch.long, device=keys.device)
+        self._eliteFitness = torch.empty(self.eliteCount, dtype=self.fitness.dtype, device=keys.device)
+        self._eliteDirty = torch.empty(self.eliteCount, dtype=torch.bool, device=keys.device)
+        self._eliteEstimated = torch.empty(self.eliteCount, dtype=torch.bool, device=keys.device)
+        self._changedRows = torch.empty(len(keys), dtype=torch.bool, device=keys.device)
+        self._changed = None  # allocated by the first call of 'self.optimize'
     #------------------------------------------------------
     def orderBy(self, results, descending=False):
         """
@@ -85,15 +565,63 @@ class BRKGA():
         The best result and its random key are returned.
         results: a tensor of objective function values (1D tensor), one value per row in 'self.keys'.
         """
+        if self.metrics is not None:
+            start = time.perf_counter()
         values,self.indexes = results.sort(descending=descending)
+        self.descending = descending
+        with torch.no_grad():
+            self.fitness.copy_(results)
+            self.dirty.fill_(False)
+        if self.metrics is not None:
+            self.metrics.lap('selection', start)
+            self.metrics.record(self, values[0])
         return values[0],self.keys[self.indexes[0]]
     #------------------------------------------------------
+    def selectBy(self, results, descending=False):
+        """
+        Select the elites and the mutant rows of the population by the 'results' 
+        of mapping an objective function to each random key, without a full sort.
+        This is a faster alternative to 'self.orderBy' for large populations,
+        since 'self.evolve' only needs to know which rows are the elites 
+        and which rows are the non-elite survivors.
+        The best result and its random key are returned.
+        POSTCONDITION: 'self.indexes' has the sorted indexes of the elites,
+                       followed by the indexes of the non-elite survivors,
+                       followed by the indexes of the 'self.mutantCount' worst rows,
+                       which are unordered.
+        """
+        if self.nonMutantCount - self.eliteCount < 1:
+            return self.orderBy(results, descending=descending)
+        if self.metrics is not None:
+            start = time.perf_counter()
+        with torch.no_grad():
+            values,elites = results.topk(self.eliteCount, largest=descending)
+            if self.mutantCount > 0:
+                # The elites are excluded from the worst rows when results are tied.
+                candidates = results.detach().clone()
+                candidates[elites] = float('inf') if descending else float('-inf')
+                _,worst = candidates.topk(self.mutantCount, largest=not descending, sorted=False)
+            else:
+                worst = elites[:0]
+            selected = torch.zeros(len(results), dtype=torch.bool, device=results.device)
+            selected[elites] = True
+            selected[worst] = True
+            survivors = (~selected).nonzero().squeeze(1)
+            self.indexes = torch.cat([elites, survivors, worst])
+            self.descending = descending
+            self.fitness.copy_(results)
+            self.dirty.fill_(False)
+        if self.metrics is not None:
+            self.metrics.lap('selection', start)
+            self.metrics.record(self, values[0])
+        return results[elites[0]],self.keys[elites[0]]
+    #------------------------------------------------------
     @property
     def elites(self):
         """
         Return a tensor of the best random keys in the population.
         PRECONDITION: The indexes of the random keys are sorted
-                      by the most recent call to 'self.orderBy'.
+                      by the most recent call to 'self.orderBy' or 'self.selectBy'.
         """
         return self.keys[self.indexes[:self.eliteCount]]
     #------------------------------------------------------
@@ -103,61 +631,1184 @@ class BRKGA():
         Return a tensor of the non-elite random keys in the population.
         PRECONDITION: The indexes of the random keys are sorted
                       by the most recent call to 'self.orderBy'.
+                      After 'self.selectBy' the non-elites are unordered.
         """
         return self.keys[self.indexes[self.eliteCount:]]
     #------------------------------------------------------
-    def optimize(self):
+    def immigrate(self, keys, results):
+        """
+        Replace the worst random keys in the population with the immigrant 'keys'
+        whose objective function values are 'results', then re-rank the population.
+        At most the non-elite rows are replaced, by the best of the immigrants.
+        The best result and its random key are returned.
+        PRECONDITION: The indexes of the random keys are sorted
+                      by the most recent call to 'self.orderBy'.
+        """
+        with torch.no_grad():
+            count = min(len(keys), len(self.keys) - self.eliteCount)
+            _,best = results.sort(descending=self.descending)
+            best = best[:count]
+            rows = self.indexes[len(self.keys) - count:]
+            self.keys[rows] = keys[best].to(self.keys)
+            self.fitness[rows] = results[best].to(self.fitness)
+            self.dirty[rows] = False
+            self.estimated[rows] = False
+        return self.orderBy(self.fitness.clone(), descending=self.descending)
+    #------------------------------------------------------
+    def breed(self, count=1):
+        """
+        Return 'count' new offspring of the ranked population, for the steady-state mode,
+        without changing the population.
+        The parents are chosen as in 'self.evolve': the elite parents from the best
+        'self.eliteCount' rows, and the non-elite parents from the other rows,
+        where the 'self.mutantCount' worst rows of the pool stand for new random keys.
+        The offspring must be evaluated and then inserted with 'self.insert'.
+        PRECONDITION: The indexes of the random keys are sorted
+                      by the most recent call to 'self.orderBy' or 'self.insert'.
+        """
+        with torch.no_grad():
+            keys = self.keys.detach()
+            shape = (count, *keys.shape[1:])
+            nonEliteCount = len(keys) - self.eliteCount
+            pool = self.indexes[self.eliteCount:]
+            mutantStart = self.nonMutantCount - self.eliteCount
+            #----
+            def parent(elite):
+                if elite:
+                    return keys[self.indexes[torch.randint(self.eliteCount, (count,), generator=self.generator, device=self.device)]]
+                selectors = torch.randint(nonEliteCount, (count,), generator=self.generator, device=self.device)
+                parents = keys[pool[selectors]]
+                mutants = selectors >= mutantStart
+                if mutants.any():
+                    parents[mutants] = torch.rand(parents[mutants].shape, dtype=keys.dtype, device=self.device, generator=self.generator)
+                return parents
+            #----
+            uniform = torch.rand(shape, dtype=keys.dtype, device=self.device, generator=self.generator)
+            if self.parentCount == 2 and self.eliteParentCount == 1:
+                return torch.where(uniform < self.bias, parent(True), parent(False))
+            parents = torch.stack([parent(i < self.eliteParentCount) for i in range(self.parentCount)])
+            choice = torch.searchsorted(self._inheritance, uniform, right=True).clamp_(max=self.parentCount - 1)
+            return parents.gather(0, choice.unsqueeze(0)).squeeze(0)
+    #------------------------------------------------------
+    def insert(self, keys, results):
+        """
+        Insert the evaluated offspring 'keys' with objective function values 'results'
+        into the ranked population, for the steady-state mode.
+        Each offspring that is better than the current worst random key replaces it,
+        and 'self.indexes' is kept sorted. Ties are resolved in favour of the population.
+        The evaluations of the offspring are counted in 'self.evaluations'.
+        The number of inserted offspring is returned.
+        PRECONDITION: The indexes of the random keys are sorted
+                      by the most recent call to 'self.orderBy', 'self.selectBy' or 'self.insert'.
+        POSTCONDITION: The indexes of the random keys are sorted.
+        """
+        n = len(self.keys)
+        self.evaluations += len(keys)
+        with torch.no_grad():
+            # Ranked in ascending order of the ranking values, which are negated when descending.
+            sign = -1 if self.descending else 1
+            ranked = self.fitness[self.indexes] * sign
+            if (ranked[1:] < ranked[:-1]).any():
+                # 'self.selectBy' leaves the non-elites unsorted.
+                ranked,order = ranked.sort(stable=True)
+                self.indexes = self.indexes[order]
+            values,candidates = (results.detach().to(self.fitness) * sign).sort(stable=True)
+            # The rank of each candidate among the population and the better candidates,
+            # after the population rows with equal results.
+            positions = torch.searchsorted(ranked, values, right=True)
+            positions += torch.arange(len(values), device=self.device)
+            count = int((positions < n).sum())
+            if count == 0:
+                return 0
+            accepted = candidates[:count]
+            positions = positions[:count]
+            # The evicted rows are the 'count' worst rows of the population.
+            rows = self.indexes[n - count:]
+            self.keys[rows] = keys[accepted].to(self.keys)
+            self.fitness[rows] = values[:count] * sign
+            self.dirty[rows] = False
+            self.estimated[rows] = False
+            kept = torch.ones(n, dtype=torch.bool, device=self.device)
+            kept[positions] = False
+            indexes = torch.empty_like(self.indexes)
+            indexes[kept] = self.indexes[:n - count]
+            indexes[positions] = rows
+            self.indexes = indexes
+        return count
+    #------------------------------------------------------
+    def intensify(self, func, batched=True, step=1.0e-2, coordinates=None, relinking=4):
+        """
+        A local search around the elites, whose neighbours are all scored with one evaluation of 'func':
+            1. Pattern search: each elite is moved by +/- the step size along each key coordinate,
+               or along 'coordinates' random key coordinates per elite.
+            2. Path relinking: 'relinking' evenly spaced random keys on the path between each pair of elites.
+        The best 'self.eliteCount' neighbours are inserted into the population with 'self.insert',
+        so each one only replaces a worse random key.
+        The step size starts at 'step', and is doubled after each improvement of the best result
+        and halved otherwise, as in a pattern search, until it falls below 'step / 1024',
+        when it starts again at 'step'.
+        'func' is applied to all the neighbours at once if 'batched' is True, otherwise to each neighbour.
+        The best result and its random key are returned.
+        PRECONDITION: The indexes of the random keys are sorted
+                      by the most recent call to 'self.orderBy' or 'self.selectBy'.
+        """
+        if self.intensifyStep is None:
+            self.intensifyStep = step
+        with torch.no_grad():
+            elites = self.keys[self.indexes[:self.eliteCount]].flatten(1)
+            bestResult = self.fitness[self.indexes[0]].clone()
+            keyCount = elites.shape[1]
+            #----
+            if coordinates is None or coordinates >= keyCount:
+                axes = torch.arange(keyCount, device=self.device).expand(self.eliteCount, keyCount)
+            else:
+                axes = torch.rand((self.eliteCount, keyCount), device=self.device, generator=self.generator).argsort(1)[:,:coordinates]
+            moves = torch.zeros((self.eliteCount, axes.shape[1], keyCount), dtype=elites.dtype, device=self.device)
+            moves.scatter_(2, axes.unsqueeze(2), self.intensifyStep)
+            neighbours = [(elites.unsqueeze(1) + moves).flatten(0, 1), (elites.unsqueeze(1) - moves).flatten(0, 1)]
+            #----
+            if relinking > 0 and self.eliteCount > 1:
+                first,second = torch.triu_indices(self.eliteCount, self.eliteCount, 1, device=self.device)
+                t = torch.arange(1, relinking + 1, dtype=elites.dtype, device=self.device).div_(relinking + 1).unsqueeze(1)
+                paths = elites[first].unsqueeze(1) + t * (elites[second] - elites[first]).unsqueeze(1)
+                neighbours.append(paths.flatten(0, 1))
+            #----
+            neighbours = torch.cat(neighbours).clamp_(0, 1).reshape(-1, *self.keys.shape[1:])
+            results = self.evaluator(func, neighbours.to(self.dtype), batched=batched).to(self.fitness.dtype)
+            best = results.topk(min(self.eliteCount, len(results)), largest=self.descending).indices
+            improved = results[best[0]] > bestResult if self.descending else results[best[0]] < bestResult
+            self.intensifyStep = min(0.5, self.intensifyStep * 2.0) if improved else self.intensifyStep / 2.0
+            if self.intensifyStep < step * 2.0**-10:
+                self.intensifyStep = step
+            # 'self.insert' counts the evaluations of the inserted neighbours.
+            self.evaluations += len(neighbours) - len(best)
+            self.insert(neighbours[best], results[best])
+        return self.fitness[self.indexes[0]],self.keys[self.indexes[0]]
+    #------------------------------------------------------
+    def restart(self, keep=1):
+        """
+        Replace all but the 'keep' best random keys with new random keys,
+        and reset the state of the optimizer and the step size of 'self.intensify'.
+        The 'keep' best random keys are moved to the first rows of the population.
+        PRECONDITION: The indexes of the random keys are sorted
+                      by the most recent call to 'self.orderBy' or 'self.selectBy'.
+        """
+        keep = min(max(0, keep), len(self.keys))
+        with torch.no_grad():
+            kept = self.indexes[:keep]
+            keys = self.keys[kept]
+            fitness = self.fitness[kept]
+            dirty = self.dirty[kept]
+            self.keys.uniform_(generator=self.generator)
+            self.keys[:keep] = keys
+            self.fitness[:keep] = fitness
+            self.dirty[:keep] = dirty
+            self.dirty[keep:] = True
+        self.optimizer.state.clear()
+        self.intensifyStep = None
+    #------------------------------------------------------
+    def optimize(self, frozen=None):
         """
         Use the optimizer passed to the constructor to adjust the random keys
         using the gradients computed by a call to 'results.backward()'.
         Note: the elites may not be the best random keys after this call,
         but the entire population of random keys will (stochastically) 
         move toward the optimum.
+        'frozen' is an optional boolean mask of the rows that must not be changed.
         """
+        if self.metrics is not None:
+            start = time.perf_counter()
         with torch.no_grad():
+            self._spare.copy_(self.keys)
             self.optimizer.step()
             self.optimizer.zero_grad()
             self.keys.data.clamp_(min=0, max=1)
+            if frozen is not None:
+                self.keys.data[frozen] = self._spare[frozen]
+            if self._changed is None:
+                self._changed = torch.empty(self.keys.shape, dtype=torch.bool, device=self.device)
+            torch.ne(self.keys, self._spare, out=self._changed)
+            torch.any(self._changed.flatten(1), 1, out=self._changedRows)
+            self.dirty |= self._changedRows
+        if self.metrics is not None:
+            self.metrics.lap('gradient', start)
+    #------------------------------------------------------
+    def _dirtyRows(self, func):
+        """
+        Return the indexes of the rows that must be evaluated by 'func'.
+        Every row is dirty when 'func' is not the function of the cached results.
+        """
+        if func is not self.fitnessFunc:
+            self.fitnessFunc = func
+            self.dirty.fill_(True)
+            self.estimated.fill_(False)
+            if self.memo is not None:
+                self.memo.clear()
+            if self.surrogate is not None:
+                self.surrogate.clear()
+        return self.dirty.nonzero().squeeze(1)
+    #------------------------------------------------------
+    def _rowKeys(self, rows):
+        """
+        Return the random keys of the 'rows' converted to the computation type 'self.dtype'.
+        """
+        keys = self.keys if len(rows) == len(self.keys) else self.keys[rows]
+        return keys.to(self.dtype)
+    #------------------------------------------------------
+    def _cache(self, rows, values, evaluations=None):
+        """
+        Store the objective function 'values' of the evaluated 'rows' in the cache,
+        and return the results tensor for the whole population.
+        The cached results of the clean rows are constants with respect to 'self.keys'.
+        'evaluations' is the number of objective function calls, by default one per row.
+        """
+        self.evaluations += len(rows) if evaluations is None else evaluations
+        if self.surrogate is not None and len(rows) > 0:
+            self.surrogate.observe(self.keys[rows], values)
+        if len(rows) == len(self.keys):
+            results = values
+        elif len(rows) == 0:
+            results = self.fitness.clone()
+        else:
+            results = self.fitness.index_put((rows,), values.to(self.fitness.dtype))
+        with torch.no_grad():
+            self.fitness.copy_(results)
+            self.dirty.fill_(False)
+            self.estimated[rows] = False
+        return results
+    #------------------------------------------------------
+    def _evaluate(self, func, rows, batched=False, chunkSize=None):
+        """
+        Evaluate the 'rows' with the evaluator passed to the constructor,
+        streaming through the rows in blocks of 'chunkSize' or 'self.blockSize' rows.
+        """
+        if self.metrics is not None:
+            start = time.perf_counter()
+        chunkSize = chunkSize or self.blockSize
+        if chunkSize is None or len(rows) <= chunkSize:
+            values = self.evaluator(func, self._rowKeys(rows), batched=batched)
+        else:
+            values = torch.cat([self.evaluator(func, self._rowKeys(chunk), batched=batched) for chunk in rows.split(chunkSize)])
+        if self.metrics is not None:
+            self.metrics.lap('evaluation', start)
+        return values
+    #------------------------------------------------------
+    def _screen(self, rows):
+        """
+        Return the dirty 'rows' that the surrogate model 'self.surrogate' selects for evaluation:
+        the best 'self.surrogate.fraction' of them by their predicted results, and every row
+        whose predicted result is as good as the worst true result of the elites,
+        so the elites always have true results.
+        The results of the other rows are set to their predictions, marked as estimated,
+        or to the worst possible result if 'self.surrogate.estimate' is False.
+        The direction of the ranking is that of the most recent call to 'self.orderBy'.
+        """
+        surrogate = self.surrogate
+        if not surrogate.ready or len(rows) == 0:
+            return rows
+        with torch.no_grad():
+            trueResults = self.fitness[~self.dirty & ~self.estimated]
+            if len(trueResults) < self.eliteCount:
+                return rows
+            threshold = trueResults.topk(self.eliteCount, largest=self.descending).values[-1]
+            predictions = surrogate.predict(self.keys[rows]).to(self.fitness.dtype)
+            promising = predictions >= threshold if self.descending else predictions <= threshold
+            count = math.ceil(surrogate.fraction * len(rows))
+            promising[predictions.topk(count, largest=self.descending).indices] = True
+            skipped = rows[~promising]
+            if surrogate.estimate:
+                self.fitness[skipped] = predictions[~promising]
+                self.estimated[skipped] = True
+            else:
+                self.fitness[skipped] = float('-inf') if self.descending else float('inf')
+        return rows[promising]
+    #------------------------------------------------------
+    def _recall(self, func, rows, batched=False, chunkSize=None):
+        """
+        Evaluate the 'rows' like 'self._evaluate', but only the rows whose random keys
+        are neither in the fitness memo 'self.memo' nor duplicates of another of the 'rows'.
+        If 'self.memo.mutate' is True the rows found in the memo are first replaced
+        by new random keys.
+        Each row counts once in the hits or misses of the memo.
+        The values of all the 'rows' and the number of evaluated rows are returned.
+        """
+        memo = self.memo
+        with torch.no_grad():
+            if memo.mutate:
+                found = memo.contains(memo.hashes(self.keys[rows]))
+                if found.any():
+                    mutantRows = rows[found]
+                    memo.mutations += len(mutantRows)
+                    self.keys[mutantRows] = torch.rand(self.keys[mutantRows].shape, dtype=self.keys.dtype,
+                                                        device=self.device, generator=self.generator)
+            hashes = memo.hashes(self.keys[rows])
+            distinct,inverse = hashes.unique(return_inverse=True)
+            first = torch.full_like(distinct, len(rows)).scatter_reduce_(0, inverse, torch.arange(len(rows), device=self.device), 'amin')
+            found,values = memo.lookup(distinct)
+            # The duplicates of another row count as hits.
+            memo.hits += len(rows) - len(distinct)
+            missing = (~found).nonzero().squeeze(1)
+            # The evaluated rows keep the ascending order of the 'rows', see 'self._rowKeys'.
+            missing = missing[first[missing].argsort()]
+        values = values.to(self.fitness.dtype)
+        if len(missing) > 0:
+            evaluated = self._evaluate(func, rows[first[missing]], batched, chunkSize)
+            memo.store(distinct[missing], evaluated)
+            values = values.index_put((missing,), evaluated.to(values.dtype))
+        return values[inverse],len(missing)
     #------------------------------------------------------
     def map(self, func):
         """
         Compute a results tensor by applying 'func' to 
         each random key in the population.
+        Only the rows that changed since the last call with 'func' are evaluated,
+        the other rows reuse their cached results.
+        The rows are evaluated by the evaluator passed to the constructor.
+        """
+        rows = self._dirtyRows(func)
+        if self.surrogate is not None:
+            rows = self._screen(rows)
+        if len(rows) == 0:
+            return self._cache(rows, None)
+        if self.memo is not None:
+            return self._cache(rows, *self._recall(func, rows))
+        return self._cache(rows, self._evaluate(func, rows))
+    #------------------------------------------------------
+    def mapBatch(self, func, chunkSize=None):
+        """
+        Compute a results tensor by applying 'func' to the whole 
+        population of random keys at once.
+        'func' receives a tensor of random keys with shape (rows, *keyShape)
+        and must return a 1D tensor of 'rows' objective function values.
+        If 'chunkSize' or 'blockSize' is given then 'func' is applied to consecutive
+        chunks of at most 'chunkSize' rows, and the results are concatenated.
+        Only the rows that changed since the last call with 'func' are evaluated,
+        the other rows reuse their cached results.
+        """
+        rows = self._dirtyRows(func)
+        if self.surrogate is not None:
+            rows = self._screen(rows)
+        if len(rows) == 0:
+            return self._cache(rows, None)
+        if self.memo is not None:
+            return self._cache(rows, *self._recall(func, rows, batched=True, chunkSize=chunkSize))
+        return self._cache(rows, self._evaluate(func, rows, batched=True, chunkSize=chunkSize))
+    #------------------------------------------------------
+    async def amap(self, func, concurrency=16, timeout=None, penalty=None):
+        """
+        Compute a results tensor by awaiting the coroutine function 'func' 
+        for each random key in the population, with at most 'concurrency' 
+        evaluations in progress at a time.
+        Use this for objective functions that wait on I/O or on a remote service:
+            results = await pop.amap(func, concurrency=64, timeout=1.0)
+            bestResult,best = pop.orderBy(results)
+        An evaluation that raises an exception or takes longer than 'timeout' seconds
+        gets the result 'penalty', by default the worst possible result 
+        for the order of the most recent ranking, and is counted in 'self.failures'.
+        Only the rows that changed since the last call with 'func' are evaluated,
+        the other rows reuse their cached results.
+        The results are detached from the random keys.
         """
-        return torch.stack([func(x) for x in self.keys])
+        rows = self._dirtyRows(func)
+        if len(rows) == 0:
+            return self._cache(rows, None)
+        if penalty is None:
+            penalty = float('-inf') if self.descending else float('inf')
+        if self.metrics is not None:
+            start = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        #----
+        async def evaluate(key):
+            async with semaphore:
+                try:
+                    return float(await asyncio.wait_for(func(key), timeout))
+                except Exception:
+                    self.failures += 1
+                    return penalty
+        #----
+        keys = self._rowKeys(rows).detach()
+        values = await asyncio.gather(*[evaluate(key) for key in keys])
+        if self.metrics is not None:
+            self.metrics.lap('evaluation', start)
+        return self._cache(rows, torch.tensor(values, dtype=self.dtype, device=self.device))
+    #------------------------------------------------------
+    def gradientStep(self, func, batched=True, chunkSize=None, descending=False, partial=False, estimate=True):
+        """
+        One gradient-assisted evaluation and ranking of the population, usually after 'self.evolve',
+        that evaluates each changed random key only once:
+            1. The dirty rows (the offspring and mutants) are evaluated with 'func'.
+            2. The optimizer adjusts those rows using the gradient of the mean result,
+               while the clean rows (the elites) are frozen.
+            3. If 'estimate' is True the results of the adjusted rows are estimated
+               to first order from their gradients and the changes of their keys,
+               and only the adjusted rows whose estimates could make them elites are 
+               evaluated again, otherwise all adjusted rows are evaluated again.
+               The evaluations after the optimizer step do not build gradients.
+            4. The population is ranked with 'self.selectBy' if 'partial' is True,
+               otherwise with 'self.orderBy'. The elites always have true results.
+        'func' is applied with 'self.mapBatch' if 'batched' is True, otherwise with 'self.map'.
+        The best result and its random key are returned.
+        """
+        mapf = (lambda f: self.mapBatch(f, chunkSize)) if batched else self.map
+        rank = self.selectBy if partial else self.orderBy
+        frozen = ~self.dirty if func is self.fitnessFunc else None
+        results = mapf(func)
+        if results.requires_grad:
+            count = len(results)
+            (results.mean().neg() if descending else results.mean()).backward()
+            if estimate:
+                # The gradient of each result with respect to its own random key.
+                gradient = self.keys.grad.mul(-count if descending else count)
+            self.optimize(frozen)
+            if estimate:
+                with torch.no_grad():
+                    moved = self.dirty.clone()
+                    trueResults = self.fitness[~moved]
+                    if len(trueResults) >= self.eliteCount:
+                        changes = gradient.mul_(self.keys - self._spare).flatten(1).sum(1)
+                        self.fitness[moved] += changes[moved].to(self.fitness.dtype)
+                        # The worst result that an elite can have without the moved rows.
+                        threshold = trueResults.topk(self.eliteCount, largest=descending).values[-1]
+                        candidates = self.fitness >= threshold if descending else self.fitness <= threshold
+                        self.dirty &= candidates
+                        self.estimated |= moved & ~candidates
+        #----
+        with torch.no_grad():
+            return rank(mapf(func), descending=descending)
+    #------------------------------------------------------
+    def fusedStep(self, func, descending=False, compiled=True):
+        """
+        One generation as a single fused step function, see 'generationStep':
+        'self.evolve', the evaluation of the offspring with the batched objective function 'func',
+        and the ranking of 'self.orderBy'. This removes the Python overhead of the chain of 
+        small tensor operations of a generation, which dominates for small populations.
+        If 'compiled' is True the step function is compiled by torch.compile for the constant 
+        shapes of the population, and runs in eager mode where compilation is unavailable or fails.
+        The step function is built again only when 'func', 'descending' or 'compiled' change,
+        and after its first call a step that would be compiled again runs in eager mode instead.
+        Only compiler errors fall back to eager mode, the errors of 'func' are raised.
+        The offspring are evaluated directly by 'func', without the evaluator, the memo, 
+        the surrogate or the metrics.
+        The best result and its random key are returned.
+        PRECONDITION: The indexes of the random keys are sorted
+                      by the most recent call to 'self.orderBy' or 'self.fusedStep',
+                      and the cached results are true results of 'func'.
+        """
+        signature = (func, descending, compiled)
+        inheritance = None if self.parentCount == 2 and self.eliteParentCount == 1 else self._inheritance
+        if self._fused is None or self._fused[0] != signature:
+            step = generationStep(func, self.eliteCount, self.nonMutantCount, self.bias, self.dtype, descending, inheritance)
+            if compiled and hasattr(torch, 'compile'):
+                step = torch.compile(step, dynamic=False)
+            self._fused = [signature, step, compiled, False]
+        _,step,compiling,warm = self._fused
+        #----
+        count = len(self.keys) - self.eliteCount
+        with torch.no_grad():
+            keys = self.keys.detach()
+            args = (keys, self.fitness, self.indexes,
+                    torch.randint(self.eliteCount, (self.eliteParentCount, count), device=self.device, generator=self.generator),
+                    torch.randint(count, (self.parentCount - self.eliteParentCount, count), device=self.device, generator=self.generator),
+                    torch.rand((self.mutantCount, *keys.shape[1:]), dtype=keys.dtype, device=self.device, generator=self.generator),
+                    torch.rand((count, *keys.shape[1:]), dtype=keys.dtype, device=self.device, generator=self.generator))
+            if not compiling:
+                newKeys,fitness,indexes = step(*args)
+            else:
+                from torch._dynamo.exc import TorchDynamoException
+                try:
+                    if warm and hasattr(torch.compiler, 'set_stance'):
+                        with torch.compiler.set_stance('eager_on_recompile'):
+                            newKeys,fitness,indexes = step(*args)
+                    else:
+                        newKeys,fitness,indexes = step(*args)
+                    self._fused[3] = True
+                except TorchDynamoException as e:
+                    # Errors of the objective function are raised again by the eager step,
+                    # and then the compiled step is kept.
+                    step = generationStep(func, self.eliteCount, self.nonMutantCount, self.bias, self.dtype, descending, inheritance)
+                    newKeys,fitness,indexes = step(*args)
+                    warnings.warn(f"fusedStep: using eager mode, compilation failed: {e}")
+                    self._fused = [signature, step, False, True]
+            #----
+            keys.copy_(newKeys)
+            self.fitness.copy_(fitness)
+            self.indexes = indexes
+            self.dirty.fill_(False)
+            self.estimated.fill_(False)
+            self.descending = descending
+            self.generation += 1
+            self.evaluations += count
+        return self.fitness[indexes[0]],self.keys[indexes[0]]
+    #------------------------------------------------------
+    def stateDict(self, clone=False):
+        """
+        Return the complete state of the optimization as a dictionary of tensors and values:
+        the random keys, sort indexes, cached results, optimizer state, 
+        random number generator state, generation and evaluation counters.
+        If 'clone' is True the tensors are copied, so the returned state
+        is not changed by later generations. With a 'storage' directory the random keys
+        and results are copied block by block into memory-mapped snapshot files,
+        instead of into memory.
+        """
+        state = {
+            'generation': self.generation,
+            'evaluations': self.evaluations,
+            'failures': self.failures,
+            'intensifyStep': self.intensifyStep,
+            'descending': self.descending,
+            'keys': self.keys.detach(),
+            'indexes': self.indexes,
+            'fitness': self.fitness,
+            'dirty': self.dirty,
+            'estimated': self.estimated,
+            'optimizer': self.optimizer.state_dict(),
+            'rng': self.generator.get_state(),
+        }
+        if not clone:
+            return state
+        keys = self._snapshot('snapshot-keys', state.pop('keys'))
+        fitness = self._snapshot('snapshot-fitness', state.pop('fitness'))
+        state = copy.deepcopy(state)
+        state.update(keys=keys, fitness=fitness)
+        return state
+    #------------------------------------------------------
+    def _snapshot(self, name, tensor):
+        """
+        Return a copy of 'tensor', in the memory-mapped file 'name' if the population 
+        has a 'storage' directory, copied in blocks of 'self.blockSize' rows.
+        """
+        if self.storage is None:
+            return tensor.clone()
+        snapshot = self._tensor(name, tensor.shape, tensor.dtype)
+        blockSize = self.blockSize or len(tensor)
+        with torch.no_grad():
+            for first in range(0, len(tensor), blockSize):
+                snapshot[first : first + blockSize] = tensor[first : first + blockSize]
+        return snapshot
+    #------------------------------------------------------
+    def loadStateDict(self, state, func=None):
+        """
+        Restore the state returned by 'self.stateDict'.
+        The population must have the same shape as the saved population.
+        'func' is the objective function of the saved results, so that the next
+        'self.map' or 'self.mapBatch' with 'func' reuses them; otherwise every row
+        is evaluated again by the next objective function.
+        """
+        with torch.no_grad():
+            self.generation = state['generation']
+            self.evaluations = state.get('evaluations', self.evaluations)
+            self.failures = state.get('failures', self.failures)
+            self.intensifyStep = state.get('intensifyStep', self.intensifyStep)
+            self.fitnessFunc = func
+            self.descending = state['descending']
+            self.keys.copy_(state['keys'])
+            self.indexes = None if state['indexes'] is None else state['indexes'].clone()
+            self.fitness.copy_(state['fitness'])
+            self.dirty.copy_(state['dirty'])
+            self.estimated.copy_(state['estimated'])
+            self.optimizer.load_state_dict(state['optimizer'])
+            self.generator.set_state(state['rng'])
+    #------------------------------------------------------
+    def save(self, path, state=None):
+        """
+        Save the state of the optimization, or the given 'state', to the file 'path'.
+        The file is replaced atomically, so an interrupted save leaves the previous file intact.
+        """
+        temporary = f"{path}.tmp"
+        torch.save(self.stateDict() if state is None else state, temporary)
+        os.replace(temporary, path)
+    #------------------------------------------------------
+    def load(self, path, func=None):
+        """
+        Restore the state of the optimization from the file 'path' written by 'self.save',
+        with the saved results of the objective function 'func', see 'self.loadStateDict'.
+        The file is memory-mapped, so the saved tensors are streamed into the population.
+        """
+        self.loadStateDict(torch.load(path, mmap=True, weights_only=True), func)
     #------------------------------------------------------
     def evolve(self):
         """
         One iteration of the "Biased Random-Key Genetic Algorithm".
         Replaces the current population of random keys with a new population.
         PRECONDITION: The indexes of the random keys are already sorted
-                      by a call to 'self.orderBy'.
+                      by a call to 'self.orderBy', or selected by 'self.selectBy'.
         POSTCONDITION: The shape of the population of random keys is unchanged.
                        The first 'self.eliteCount' random keys are still the best keys from
-                       the most recent call to 'self.orderBy'.
+                       the most recent call to 'self.orderBy' or 'self.selectBy'.
+                       The cached results of the elites are kept, all other rows are dirty,
+                       as well as the elites whose cached results are estimated.
+        Note: the new population is built in preallocated buffers, and then swapped
+              with the storage of 'self.keys', so no new tensors are allocated.
+              The offspring are built in blocks of 'self.blockSize' rows.
         """
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
         with torch.no_grad():
-            keyShape = self.keys.shape[1:]
+            keys = self.keys.detach()
+            population = self._spare
+            eliteIndexes = self.indexes[:self.eliteCount]
+            nonEliteCount = len(keys) - self.eliteCount
+            blockSize = len(self._uniform)
             #----
-            if self.mutantCount > 0:
-                mutants = torch.rand(self.mutantCount, *keyShape, dtype=self.dtype)
-                nonElites = torch.cat([self.keys[self.indexes[self.eliteCount : self.nonMutantCount]], mutants], 0)
-            else:
-                nonElites = self.keys[self.indexes[self.eliteCount : self.nonMutantCount]]
-            nonEliteCount = len(nonElites)
+            torch.index_select(self.fitness, 0, eliteIndexes, out=self._eliteFitness)
+            torch.index_select(self.dirty, 0, eliteIndexes, out=self._eliteDirty)
+            torch.index_select(self.estimated, 0, eliteIndexes, out=self._eliteEstimated)
+            self.fitness[:self.eliteCount] = self._eliteFitness
+            # Elites with estimated results are evaluated again.
+            self.dirty[:self.eliteCount] = self._eliteDirty.logical_or_(self._eliteEstimated)
+            self.dirty[self.eliteCount:] = True
+            self.estimated.fill_(False)
+            #----
+            elites = population[:self.eliteCount]
+            torch.index_select(keys, 0, eliteIndexes, out=elites)
+            if metrics is not None:
+                start = metrics.lap('crossover', start)
+            #----
+            # The mutants replace the worst random keys of the current population in place,
+            # so that the pool of non-elite parents is the rows 'self.indexes[self.eliteCount:]'.
+            mutantIndexes = self.indexes[self.nonMutantCount:]
+            for first in range(0, self.mutantCount, blockSize):
+                rows = mutantIndexes[first : first + blockSize]
+                keys.index_copy_(0, rows, self._uniform[:len(rows)].uniform_(generator=self.generator))
+            if metrics is not None:
+                start = metrics.lap('mutation', start)
+            #----
+            pool = self.indexes[self.eliteCount:]
+            for first in range(0, nonEliteCount, blockSize):
+                count = min(blockSize, nonEliteCount - first)
+                offspring = population[self.eliteCount + first : self.eliteCount + first + count]
+                poolRows = self._poolRows[:count]
+                if self.parentCount == 2 and self.eliteParentCount == 1:
+                    eliteSelectors = self._eliteSelectors[:count].random_(0, self.eliteCount, generator=self.generator)
+                    torch.index_select(elites, 0, eliteSelectors, out=self._selectedElites[:count])
+                    #----
+                    nonEliteSelectors = self._nonEliteSelectors[:count].random_(0, nonEliteCount, generator=self.generator)
+                    torch.index_select(pool, 0, nonEliteSelectors, out=poolRows)
+                    torch.index_select(keys, 0, poolRows, out=self._selectedNonElites[:count])
+                    #----
+                    torch.lt(self._uniform[:count].uniform_(generator=self.generator), self.bias, out=self._inherit[:count])
+                    torch.where(self._inherit[:count], self._selectedElites[:count], self._selectedNonElites[:count], out=offspring)
+                else:
+                    for parent in range(self.parentCount):
+                        selectors = self._parentSelectors[parent][:count]
+                        if parent < self.eliteParentCount:
+                            torch.index_select(elites, 0, selectors.random_(0, self.eliteCount, generator=self.generator), out=self._parents[parent][:count])
+                        else:
+                            torch.index_select(pool, 0, selectors.random_(0, nonEliteCount, generator=self.generator), out=poolRows)
+                            torch.index_select(keys, 0, poolRows, out=self._parents[parent][:count])
+                    #----
+                    choice = self._choice[:count]
+                    torch.searchsorted(self._inheritance, self._uniform[:count].uniform_(generator=self.generator), right=True, out=choice)
+                    choice.clamp_(max=self.parentCount - 1)
+                    torch.gather(self._parents[:, :count], 0, choice.unsqueeze(0), out=offspring.unsqueeze(0))
+            #----
+            self._spare = keys
+            self.keys.data = population
+            self.generation += 1
+        if metrics is not None:
+            metrics.lap('crossover', start)
+    #------------------------------------------------------
+
+
+
+#===============================================================================
+# Fused Generation Step
+#===============================================================================
+
+def generationStep(func, eliteCount, nonMutantCount, bias, dtype, descending=False, inheritance=None):
+    """
+    Return a function of one whole generation of the BRKGA as a single chain of tensor operations,
+    the crossover and mutation of 'BRKGA.evolve', the evaluation of the offspring with the 
+    batched objective function 'func', and the ranking of 'BRKGA.orderBy', so that it can be 
+    compiled into one fused step by torch.compile:
+        step(keys, fitness, indexes, eliteSelectors, poolSelectors, mutants, inherit) -> keys,fitness,indexes
+    The random numbers are drawn by the caller, outside the compiled region:
+        eliteSelectors, poolSelectors: the (parents, offspring) elite and non-elite parents of each
+                                       offspring, in the elites and in the pool of non-elite parents.
+        mutants: the new random keys that replace the worst rows of the pool.
+        inherit: uniform random numbers that choose the parent of each key of each offspring.
+    'inheritance' is the cumulative inheritance probabilities of a multi-parent crossover,
+    see 'BRKGA.evolve', or None for one elite and one non-elite parent.
+    """
+    def step(keys, fitness, indexes, eliteSelectors, poolSelectors, mutants, inherit):
+        eliteRows = indexes[:eliteCount]
+        elites = keys[eliteRows]
+        pool = torch.cat([keys[indexes[eliteCount:nonMutantCount]], mutants])
+        if inheritance is None:
+            offspring = torch.where(inherit < bias, elites[eliteSelectors[0]], pool[poolSelectors[0]])
+        else:
+            parents = torch.cat([elites[eliteSelectors], pool[poolSelectors]])
+            choice = torch.searchsorted(inheritance, inherit, right=True).clamp_(max=len(inheritance) - 1)
+            offspring = parents.gather(0, choice.unsqueeze(0)).squeeze(0)
+        keys = torch.cat([elites, offspring])
+        fitness = torch.cat([fitness[eliteRows], func(offspring.to(dtype)).to(fitness.dtype)])
+        return keys,fitness,fitness.argsort(descending=descending)
+    return step
+
+
+
+#===============================================================================
+# Multiple Runs
+#===============================================================================
+
+class MultiBRKGA():
+    """
+    'runs' independent BRKGA populations of shape 'populationShape' = (population size, *keyShape),
+    kept in one tensor of random keys with shape (runs, population size, *keyShape), 
+    so that the evolution, ranking and evaluation of all the runs are single vectorized calls.
+    Use it for hyperparameter sweeps and restart portfolios of small populations.
+    'elites', 'mutants' and 'bias' are either one value for every run, 
+    or a sequence with one value per run; see 'BRKGA' for their meaning.
+    Each offspring has one elite and one non-elite parent.
+    'self.evaluations' is the number of evaluations of each run.
+    All the runs share the random number stream of 'generator', 
+    by default a new generator seeded with 'seed'.
+    """
+    def __init__(self, runs, populationShape, elites=1, mutants=1, bias=0.5, dtype=torch.float64, 
+                    device=None, keyDtype=None, seed=None, generator=None):
+        self.runCount = runs
+        self.dtype = dtype
+        self.keyDtype = dtype if keyDtype is None else keyDtype
+        self.device = torch.device('cpu') if device is None else torch.device(device)
+        if generator is None:
+            generator = torch.Generator(self.device)
+            generator.manual_seed(torch.randint(2**62, ()).item() if seed is None else seed)
+        self.generator = generator
+        #----
+        def perRun(value, dtype):
+            return torch.as_tensor(value, dtype=dtype, device=self.device).expand(runs).clone()
+        #----
+        populationSize = populationShape[0]
+        self.eliteCounts = perRun(elites, torch.long).clamp_(1, populationSize)
+        self.mutantCounts = perRun(mutants, torch.long).clamp_(min=0).minimum(populationSize - self.eliteCounts)
+        self.bias = perRun(bias, torch.float64)
+        if not ((0.0 < self.bias) & (self.bias < 1.0)).all():
+            raise ValueError(f"bias must be in the interval (0,1): {bias}")
+        #----
+        self.keys = torch.rand((runs, *populationShape), dtype=self.keyDtype, device=self.device, generator=self.generator)
+        self.fitness = torch.zeros((runs, populationSize), dtype=dtype, device=self.device)
+        self.dirty = torch.ones((runs, populationSize), dtype=torch.bool, device=self.device)
+        self.indexes = None
+        self.descending = False
+        self.generation = 0
+        self.evaluations = torch.zeros(runs, dtype=torch.long, device=self.device)
+        self._runs = torch.arange(runs, device=self.device).unsqueeze(1)
+        self._rows = torch.arange(populationSize, device=self.device).unsqueeze(0)
+    #------------------------------------------------------
+    def _perKey(self, values):
+        """
+        Return the per-run 'values' (runs, ...) broadcastable against the random keys.
+        """
+        return values.reshape(values.shape + (1,) * (self.keys.dim() - values.dim()))
+    #------------------------------------------------------
+    def mapBatch(self, func, chunkSize=None):
+        """
+        Compute the (runs, population size) results tensor by applying 'func' to the 
+        dirty random keys of all the runs at once, see 'BRKGA.mapBatch'.
+        'func' receives a tensor of random keys with shape (rows, *keyShape).
+        """
+        with torch.no_grad():
+            runs,rows = self.dirty.nonzero(as_tuple=True)
+            if len(rows) > 0:
+                values = evaluate(func, self.keys[runs,rows].to(self.dtype), batched=True, chunkSize=chunkSize)
+                self.fitness[runs,rows] = values.to(self.dtype)
+                self.evaluations += torch.bincount(runs, minlength=self.runCount)
+            self.dirty.fill_(False)
+        return self.fitness.clone()
+    #------------------------------------------------------
+    def orderBy(self, results, descending=False):
+        """
+        Sort the population of each run by its (runs, population size) 'results'.
+        The best result (runs,) and the best random key (runs, *keyShape) of each run are returned.
+        """
+        with torch.no_grad():
+            values,self.indexes = results.sort(1, descending=descending)
+            self.fitness.copy_(results)
+            self.descending = descending
+        return values[:,0],self.keys[self._runs.squeeze(1),self.indexes[:,0]]
+    #------------------------------------------------------
+    def evolve(self):
+        """
+        One iteration of the "Biased Random-Key Genetic Algorithm" for every run, see 'BRKGA.evolve'.
+        PRECONDITION: The indexes of the random keys are sorted by a call to 'self.orderBy'.
+        POSTCONDITION: The first 'self.eliteCounts' random keys of each run are its elites,
+                       with their cached results, all other rows are dirty.
+        """
+        with torch.no_grad():
+            runCount,populationSize = self.fitness.shape
+            elites = self.eliteCounts.unsqueeze(1)
+            mutantStart = (populationSize - self.mutantCounts).unsqueeze(1)
+            shape = self.fitness.shape
             #----
-            elites = self.elites
-            eliteSelectors = torch.multinomial(torch.full((self.eliteCount,), 0.5), nonEliteCount, replacement=True)
-            selectedElites = elites[eliteSelectors]
+            uniform = torch.rand(shape, dtype=torch.float64, device=self.device, generator=self.generator)
+            eliteRows = self.indexes.gather(1, uniform.mul_(elites).long())
+            uniform = torch.rand(shape, dtype=torch.float64, device=self.device, generator=self.generator)
+            # A run whose elites fill the population has no offspring, and an empty pool.
+            poolSelectors = uniform.mul_(populationSize - elites).long().add_(elites).clamp_(max=populationSize - 1)
+            poolRows = self.indexes.gather(1, poolSelectors)
             #----
-            nonEliteSelectors = torch.multinomial(torch.full((nonEliteCount,), 0.5), nonEliteCount, replacement=True)
-            selectedNonElites = nonElites[nonEliteSelectors]
+            # The 'self.mutantCounts' worst rows of the non-elite pool are new random keys.
+            mutants = torch.rand(self.keys.shape, dtype=self.keys.dtype, device=self.device, generator=self.generator)
+            nonElites = torch.where(self._perKey(poolSelectors >= mutantStart), mutants, self.keys[self._runs,poolRows])
+            inherit = torch.rand(self.keys.shape, dtype=torch.float64, device=self.device, generator=self.generator)
+            offspring = torch.where(inherit < self._perKey(self.bias), self.keys[self._runs,eliteRows], nonElites)
             #----
-            offspringSelectors = torch.empty((nonEliteCount, *keyShape), dtype=self.dtype).bernoulli_(p=0.5)
-            offspring = (offspringSelectors * selectedElites) + ((1.0 - offspringSelectors) * selectedNonElites)
+            isElite = self._rows < elites
+            self.keys = torch.where(self._perKey(isElite), self.keys[self._runs,self.indexes], offspring)
+            self.fitness = self.fitness.gather(1, self.indexes)
+            self.dirty = ~isElite
+            self.generation += 1
+    #------------------------------------------------------
+    def run(self, func, generations, descending=False, target=None, chunkSize=None):
+        """
+        Evolve all the runs for at most 'generations' generations, or until
+        every run has a best result at least as good as 'target'.
+        'func' is a batched objective function, see 'self.mapBatch'.
+        A list with a 'RunResult' for each run is returned, where 'generations' is 
+        the generation of the best result of the run.
+        """
+        start = time.perf_counter()
+        firstGeneration = self.generation
+        firstEvaluations = self.evaluations.clone()
+        bestResults,best = self.orderBy(self.mapBatch(func, chunkSize), descending=descending)
+        best = best.clone()
+        found = torch.zeros(self.runCount, dtype=torch.long, device=self.device)
+        for _ in range(generations):
+            if target is not None and ((bestResults >= target) if descending else (bestResults <= target)).all():
+                break
+            self.evolve()
+            results,keys = self.orderBy(self.mapBatch(func, chunkSize), descending=descending)
+            improved = (results > bestResults) if descending else (results < bestResults)
+            bestResults = torch.where(improved, results, bestResults)
+            best[improved] = keys[improved]
+            found[improved] = self.generation - firstGeneration
+        #----
+        elapsed = time.perf_counter() - start
+        evaluations = (self.evaluations - firstEvaluations).tolist()
+        reasons = ['generations'] * self.runCount
+        if target is not None:
+            reached = (bestResults >= target) if descending else (bestResults <= target)
+            reasons = ['target' if r else 'generations' for r in reached.tolist()]
+        return [RunResult(bestResults[i].item(), best[i], found[i].item(), evaluations[i], elapsed, 0, reasons[i]) 
+                    for i in range(self.runCount)]
+
+
+
+#===============================================================================
+# Metrics
+#===============================================================================
+
+class Metrics():
+    """
+    Record the timings and statistics of each generation of a BRKGA population.
+    Pass an instance to the BRKGA constructor as 'metrics'.
+    Each ranking of the population, by 'orderBy' or 'selectBy', ends a generation 
+    and appends a record to 'self.records' with:
+        generation:     the generation counter of the population.
+        evaluation, selection, crossover, mutation, gradient:
+                        the seconds spent in each phase since the previous record.
+        evaluations:    the number of objective function evaluations since the previous record.
+        allocations:    the number of CUDA memory allocations since the previous record,
+                        or None for CPU tensors.
+        bestResult:     the best result of the generation.
+        eliteSpread:    the difference of the worst and best results of the elites.
+        diversity:      the mean variance of each key over the population,
+                        only if 'diversity' is True since it costs a pass over the keys.
+    Note: CUDA operations are asynchronous, so the phase timings of CUDA tensors
+          are only approximate.
+    """
+    phases = ('evaluation', 'selection', 'crossover', 'mutation', 'gradient')
+    #------------------------------------------------------
+    def __init__(self, diversity=True):
+        self.diversity = diversity
+        self.records = []
+        self.current = dict.fromkeys(self.phases, 0.0)
+        self.evaluations = 0
+        self.allocations = 0
+    #------------------------------------------------------
+    def lap(self, phase, start):
+        """
+        Add the time since 'start' to 'phase', and return the current time.
+        """
+        now = time.perf_counter()
+        self.current[phase] += now - start
+        return now
+    #------------------------------------------------------
+    def record(self, pop, bestResult):
+        """
+        Append the record of the generation of 'pop' that ends now.
+        """
+        allocations = None
+        if pop.keys.is_cuda:
+            count = torch.cuda.memory_stats(pop.keys.device).get('allocation.all.allocated', 0)
+            allocations,self.allocations = count - self.allocations,count
+        with torch.no_grad():
+            eliteResults = pop.fitness[pop.indexes[:pop.eliteCount]]
+            record = {
+                'generation': pop.generation,
+                **self.current,
+                'evaluations': pop.evaluations - self.evaluations,
+                'allocations': allocations,
+                'bestResult': float(bestResult),
+                'eliteSpread': (eliteResults.max() - eliteResults.min()).item(),
+                'diversity': pop.keys.var(0).mean().item() if self.diversity else None,
+            }
+        self.records.append(record)
+        self.current = dict.fromkeys(self.phases, 0.0)
+        self.evaluations = pop.evaluations
+    #------------------------------------------------------
+    def totals(self):
+        """
+        Return the total seconds spent in each phase over all records.
+        """
+        return {phase:sum(record[phase] for record in self.records) for phase in self.phases}
+    #------------------------------------------------------
+    def toCSV(self, path):
+        """
+        Write the records to the CSV file 'path'.
+        """
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(self.records[0]) if self.records else [])
+            writer.writeheader()
+            writer.writerows(self.records)
+    #------------------------------------------------------
+    def toJSONL(self, path):
+        """
+        Write the records to the JSON lines file 'path', one record per line.
+        """
+        with open(path, 'w') as file:
+            for record in self.records:
+                file.write(json.dumps(record) + '\n')
+
+
+
+#===============================================================================
+# Run Driver
+#===============================================================================
+
+RunResult = namedtuple('RunResult', 'bestResult best generations evaluations elapsed restarts reason')
+
+
+def run(pop, func, batched=True, descending=False, grad=False, estimate=True, partial=False,
+            target=None, maxGenerations=None, maxTime=None, maxEvaluations=None, 
+            stagnation=None, restarts=0, keep=1, callback=None, every=100, checkpointer=None, intensify=None,
+            fused=False):
+    """
+    Optimize the objective function 'func' with the BRKGA population 'pop'
+    until one of the stopping conditions is met, and return a 'RunResult'.
+    'func' is applied with 'pop.mapBatch' if 'batched' is True, otherwise with 'pop.map'.
+    If 'grad' is True the gradients of the results are used to improve 
+    the random keys in each generation, see 'pop.gradientStep' for 'estimate'.
+    If 'partial' is True the population is ranked with 'pop.selectBy', otherwise with 'pop.orderBy'.
+    If 'intensify' is given the elites are improved by 'pop.intensify' every 'intensify' generations.
+    If 'fused' is True each generation is one compiled 'pop.fusedStep' of the batched 'func',
+    instead of 'pop.evolve' and the evaluation and ranking, and 'grad' and 'partial' are ignored.
+    Stopping conditions, each one disabled when None:
+        target:         the best result is at least as good as 'target'.
+        maxGenerations: the number of generations of this run.
+        maxTime:        the wall-clock seconds of this run.
+        maxEvaluations: the number of objective function evaluations of this run.
+        stagnation:     the number of generations without an improvement of the best result.
+                        The population is restarted 'restarts' times, keeping the 
+                        'keep' best random keys, before the run stops.
+    A KeyboardInterrupt also stops the run.
+    'callback' is called with a 'RunResult' after ranking the initial population 
+    and then every 'every' generations; the run stops if it returns True.
+    'checkpointer' is a 'Checkpointer' that is stepped once per generation.
+    """
+    mapf = pop.mapBatch if batched else pop.map
+    rank = pop.selectBy if partial and not fused else pop.orderBy
+    better = (lambda a,b: a > b) if descending else (lambda a,b: a < b)
+    start = time.perf_counter()
+    firstGeneration = pop.generation
+    firstEvaluations = pop.evaluations
+    restartCount = 0
+    reason = None
+    #----
+    def state():
+        return RunResult(bestResult, best, pop.generation - firstGeneration, pop.evaluations - firstEvaluations, 
+                            time.perf_counter() - start, restartCount, reason)
+    #----
+    result,key = rank(mapf(func), descending=descending)
+    bestResult,best = result.item(),key.detach().clone()
+    improved = pop.generation
+    try:
+        if callback is not None and callback(state()):
+            reason = 'callback'
+        while reason is None:
+            if target is not None and not better(target, bestResult):
+                reason = 'target'
+            elif maxGenerations is not None and pop.generation - firstGeneration >= maxGenerations:
+                reason = 'generations'
+            elif maxTime is not None and time.perf_counter() - start >= maxTime:
+                reason = 'time'
+            elif maxEvaluations is not None and pop.evaluations - firstEvaluations >= maxEvaluations:
+                reason = 'evaluations'
+            if reason is not None:
+                break
+            #----
+            if fused:
+                result,key = pop.fusedStep(func, descending=descending)
+            elif grad:
+                pop.evolve()
+                result,key = pop.gradientStep(func, batched=batched, descending=descending, partial=partial, estimate=estimate)
+            else:
+                pop.evolve()
+                result,key = rank(mapf(func), descending=descending)
+            if intensify is not None and pop.generation % intensify == 0:
+                result,key = pop.intensify(func, batched=batched)
+            #----
+            if better(result.item(), bestResult):
+                bestResult,best = result.item(),key.detach().clone()
+                improved = pop.generation
+            elif stagnation is not None and pop.generation - improved >= stagnation:
+                if restartCount >= restarts:
+                    reason = 'stagnation'
+                    break
+                restartCount += 1
+                pop.restart(keep)
+                rank(mapf(func), descending=descending)
+                improved = pop.generation
             #----
-            torch.cat([elites, offspring], 0, out=self.keys)
+            if checkpointer is not None:
+                checkpointer.step()
+            if callback is not None and pop.generation % every == 0 and callback(state()):
+                reason = 'callback'
+    except KeyboardInterrupt:
+        reason = 'interrupted'
+    return state()
+
+
+def steadyState(pop, func, batched=True, descending=False, batchSize=1, executor=None, inFlight=None,
+                    target=None, maxTime=None, maxEvaluations=None, callback=None, every=100):
+    """
+    Optimize the objective function 'func' with the BRKGA population 'pop' in the steady-state mode,
+    and return a 'RunResult' whose 'generations' is the number of evaluated batches.
+    Instead of replacing the whole non-elite population each generation,
+    batches of 'batchSize' offspring are bred, evaluated and inserted into the ranked
+    population, see 'pop.breed' and 'pop.insert', so that an improvement is available
+    to the next batch as soon as it is found.
+    'executor' is an optional 'concurrent.futures.Executor' that evaluates up to 'inFlight'
+    batches concurrently, by default two batches per worker; each batch is inserted as soon
+    as it completes, so the workers stay busy when the evaluation times vary widely.
+    With a process pool 'func' must be picklable.
+    The stopping conditions are as for 'run'; 'callback' is called every 'every' batches.
+    """
+    better = (lambda a,b: a > b) if descending else (lambda a,b: a < b)
+    start = time.perf_counter()
+    firstEvaluations = pop.evaluations
+    batches = 0
+    reason = None
+    #----
+    def state():
+        return RunResult(bestResult, best, batches, pop.evaluations - firstEvaluations,
+                            time.perf_counter() - start, 0, reason)
+    #----
+    def stopping():
+        if target is not None and not better(target, bestResult):
+            return 'target'
+        if maxTime is not None and time.perf_counter() - start >= maxTime:
+            return 'time'
+        if maxEvaluations is not None and pop.evaluations - firstEvaluations >= maxEvaluations:
+            return 'evaluations'
+        return None
+    #----
+    def inserted(keys, results):
+        nonlocal batches,bestResult,best
+        pop.insert(keys, results)
+        batches += 1
+        result = pop.fitness[pop.indexes[0]].item()
+        if better(result, bestResult):
+            bestResult,best = result,pop.keys[pop.indexes[0]].detach().clone()
+        if callback is not None and batches % every == 0 and callback(state()):
+            return 'callback'
+        return stopping()
+    #----
+    mapf = pop.mapBatch if batched else pop.map
+    result,key = pop.orderBy(mapf(func), descending=descending)
+    bestResult,best = result.item(),key.detach().clone()
+    try:
+        if callback is not None and callback(state()):
+            reason = 'callback'
+        reason = reason or stopping()
+        if executor is None:
+            while reason is None:
+                keys = pop.breed(batchSize)
+                with torch.no_grad():
+                    results = evaluate(func, keys.to(pop.dtype), batched)
+                reason = inserted(keys, results)
+        else:
+            inFlight = inFlight or 2 * getattr(executor, '_max_workers', 1)
+            pending = {}
+            while reason is None:
+                while len(pending) < inFlight:
+                    keys = pop.breed(batchSize)
+                    pending[executor.submit(evaluate, func, keys.to(pop.dtype), batched)] = keys
+                done,_ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    keys = pending.pop(future)
+                    reason = reason or inserted(keys, future.result().detach())
+            for future in pending:
+                future.cancel()
+    except KeyboardInterrupt:
+        reason = 'interrupted'
+    return state()
+
+
+
+#===============================================================================
+# Checkpoints
+#===============================================================================
+
+class Checkpointer():
+    """
+    Periodically save the state of the BRKGA population 'pop' to the file 'path'
+    on a background thread, so that the writes do not stall the generation loop.
+    Call 'self.step()' once per generation; every 'interval' generations a copy 
+    of the state is taken and written while the optimization continues.
+    At most one write is in progress: a new checkpoint waits for the previous write.
+    """
+    def __init__(self, pop, path, interval=1000):
+        self.pop = pop
+        self.path = path
+        self.interval = max(1, interval)
+        self.executor = ThreadPoolExecutor(1)
+        self.pending = None
+    #------------------------------------------------------
+    def step(self):
+        """
+        Take a checkpoint if the generation counter is a multiple of 'self.interval'.
+        """
+        if self.pop.generation % self.interval == 0:
+            self.checkpoint()
+    #------------------------------------------------------
+    def checkpoint(self):
+        """
+        Take a checkpoint now.
+        """
+        # The previous write may still read the snapshot files of a population with 'storage'.
+        self.wait()
+        state = self.pop.stateDict(clone=True)
+        self.pending = self.executor.submit(self.pop.save, self.path, state)
+    #------------------------------------------------------
+    def wait(self):
+        """
+        Wait for the write in progress, if any, and raise its exception if it failed.
+        """
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+    #------------------------------------------------------
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+    #------------------------------------------------------
+    def __enter__(self):
+        return self
     #------------------------------------------------------
+    def __exit__(self, *args):
+        self.close()
 
 
 
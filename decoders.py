@@ -0,0 +1,203 @@
+"""
+File: decoders.py
+
+Description:
+
+Batched decoders of random keys for permutation and sequencing problems,
+such as the travelling salesman, flow-shop and job-shop scheduling problems.
+
+Every decoder and evaluator accepts a single random key or a batch of random keys,
+so the objective functions can be applied to a whole population with 'BRKGA.mapBatch'.
+Like the 'box' decoders of the examples, each problem returns a pair of functions:
+    decode(keys)    -> the permutations or sequences of the random keys.
+    evaluate(keys)  -> the objective function values of the random keys.
+
+See: [1] Random-key genetic algorithms, by José Fernando Gonçalves, Mauricio G. C. Resende.
+
+"""
+
+import torch
+
+
+#===============================================================================
+# Decoders
+#===============================================================================
+
+def permutation(keys):
+    """
+    Return the permutations that sort the random keys along the last dimension.
+    """
+    return keys.argsort(-1)
+
+
+def groupedPermutation(keys, groups):
+    """
+    Split the last dimension of the random keys into 'groups' equal groups,
+    and return the permutation that sorts each group, with shape (..., groups, groupSize).
+    E.g. the order of the jobs on each machine, or of the operations of each job.
+    """
+    return keys.unflatten(-1, (groups, -1)).argsort(-1)
+
+
+def operationSequence(keys, jobs):
+    """
+    Decode random keys with 'jobs * operations' keys per row into sequences of job numbers,
+    where the k-th occurrence of job j in a sequence is the k-th operation of job j.
+    This is the operation-based representation of job-shop schedules.
+    """
+    return keys.argsort(-1).remainder(jobs)
+
+
+#===============================================================================
+# Evaluators
+#===============================================================================
+
+def tourLength(distances, tours):
+    """
+    Return the lengths of the closed 'tours' (..., cities)
+    on the precomputed (cities, cities) 'distances' matrix.
+    """
+    return distances[tours, tours.roll(-1, -1)].sum(-1)
+
+
+def flowShopMakespan(times, sequences):
+    """
+    Return the makespans of the permutation flow-shop schedules
+    of the job 'sequences' (..., jobs) with processing 'times' (jobs, machines).
+    The completion times of each job on all machines are computed at once:
+        C[j] = S[j] + cummax(C[j-1] - S[j] + p[j])
+    where p[j] are the processing times of the j-th job of a sequence,
+    and S[j] is their cumulative sum over the machines.
+    """
+    p = times[sequences]                                     # (..., jobs, machines)
+    S = p.cumsum(-1)
+    completion = torch.zeros_like(p[...,0,:])
+    for j in range(p.shape[-2]):
+        completion = S[...,j,:] + (completion - S[...,j,:] + p[...,j,:]).cummax(-1).values
+    return completion[...,-1]
+
+
+def jobShopMakespan(machines, times, sequences):
+    """
+    Return the makespans of the semi-active job-shop schedules of the operation
+    'sequences' (..., jobs * operations), see 'operationSequence'.
+    'machines' and 'times' are (jobs, operations) tensors with the machine and
+    processing time of each operation of each job.
+    The schedules of a whole batch are built together, one operation at a time.
+    """
+    jobCount,operationCount = machines.shape
+    batchShape = sequences.shape[:-1]
+    sequences = sequences.reshape(-1, sequences.shape[-1])
+    batch = torch.arange(len(sequences), device=sequences.device)
+    nextOperation = torch.zeros((len(sequences), jobCount), dtype=torch.long, device=sequences.device)
+    jobReady = torch.zeros((len(sequences), jobCount), dtype=times.dtype, device=times.device)
+    machineReady = torch.zeros((len(sequences), int(machines.max()) + 1), dtype=times.dtype, device=times.device)
+    for position in range(sequences.shape[-1]):
+        job = sequences[:,position]
+        operation = nextOperation[batch,job]
+        machine = machines[job,operation]
+        finish = torch.max(jobReady[batch,job], machineReady[batch,machine]) + times[job,operation]
+        jobReady[batch,job] = finish
+        machineReady[batch,machine] = finish
+        nextOperation[batch,job] += 1
+    return jobReady.max(-1).values.reshape(batchShape)
+
+
+class IncrementalTours():
+    """
+    Keep the edge lengths of a batch of 'tours' (rows, cities) on the 'distances' matrix,
+    so that the tour lengths can be updated when only a few positions of the tours change,
+    e.g. by swap, insertion or 2-opt moves, in time proportional to the number of changes.
+    """
+    def __init__(self, distances, tours):
+        self.distances = distances
+        self.tours = tours.clone()
+        self.edges = distances[self.tours, self.tours.roll(-1, -1)]
+        self.lengths = self.edges.sum(-1)
+    #------------------------------------------------------
+    def update(self, tours, positions):
+        """
+        Replace the tours with the new 'tours', which differ from the current tours
+        at most at the (rows, changes) tensor of 'positions', and return the new tour lengths.
+        The positions may repeat within a row.
+        """
+        cities = tours.shape[-1]
+        # The edges that start at a changed position or end at one.
+        edges = torch.cat([positions, (positions - 1).remainder(cities)], -1).sort(-1).values
+        unique = torch.ones_like(edges, dtype=torch.bool)
+        unique[:,1:] = edges[:,1:] != edges[:,:-1]
+        #----
+        starts = tours.gather(1, edges)
+        ends = tours.gather(1, (edges + 1).remainder(cities))
+        lengths = self.distances[starts,ends]
+        changes = (lengths - self.edges.gather(1, edges)).mul(unique)
+        #----
+        self.edges.scatter_(1, edges, lengths)
+        self.lengths += changes.sum(-1)
+        self.tours = tours.clone()
+        return self.lengths
+
+
+#===============================================================================
+# Problems
+#===============================================================================
+
+def tsp(distances):
+    """
+    The travelling salesman problem on the (cities, cities) 'distances' matrix.
+    Keyshape: (population size, cities)
+    """
+    #----
+    def decode(keys):
+        return permutation(keys)
+    #----
+    def evaluate(keys):
+        return tourLength(distances, decode(keys))
+    #----
+    return decode,evaluate
+
+
+def flowShop(times):
+    """
+    The permutation flow-shop problem with processing 'times' (jobs, machines).
+    Keyshape: (population size, jobs)
+    """
+    #----
+    def decode(keys):
+        return permutation(keys)
+    #----
+    def evaluate(keys):
+        return flowShopMakespan(times, decode(keys))
+    #----
+    return decode,evaluate
+
+
+def jobShop(machines, times):
+    """
+    The job-shop problem with the 'machines' and processing 'times' (jobs, operations)
+    of the operations of each job.
+    Keyshape: (population size, jobs * operations)
+    """
+    jobCount = machines.shape[0]
+    #----
+    def decode(keys):
+        return operationSequence(keys, jobCount)
+    #----
+    def evaluate(keys):
+        return jobShopMakespan(machines, times, decode(keys))
+    #----
+    return decode,evaluate
+
+
+
+
+
+##===================================================
+
+if __name__ == '__main__':
+    from brkga import BRKGA,run
+    cities = torch.rand(50, 2, dtype=torch.float64)
+    decode,f = tsp(torch.cdist(cities, cities))
+    pop = BRKGA((200,50), elites=20, mutants=20, bias=0.7)
+    state = run(pop, f, maxGenerations=2000, callback=lambda s: print(f"[{s.generations:6d}] {s.bestResult:.6f}"))
+    print(f"Tour: {decode(state.best).tolist()}")
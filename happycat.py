@@ -12,13 +12,17 @@ See: "HappyCat – A Simple Function Class Where Well-Known Direct Search Algori
 """
 
 import torch
-from brkga import BRKGA,optAdam
+from brkga import BRKGA,optSGD,optAdam,run
 
 
 def HappyCat(x, alpha=1/8):
-    X = x.dot(x)
-    N = len(x)
-    return (X - N).pow(2.0).pow(alpha) + (X.div(2.0) + x.sum())/N + 0.5
+    """
+    'x' is a single parameter vector, or a batch of parameter vectors
+    with shape (rows, parameters) which gives one result per row.
+    """
+    X = x.mul(x).sum(-1)
+    N = x.shape[-1]
+    return (X - N).pow(2.0).pow(alpha) + (X.div(2.0) + x.sum(-1))/N + 0.5
 
 
 def box0(fun, lower, upper):
@@ -26,6 +30,7 @@ def box0(fun, lower, upper):
     1 dimension per population member.
     Keyshape: (population size, parameter keys)
     Parameter keys only.
+    The functions accept a single random key or a batch of random keys.
     """
     width = upper - lower
     #----
@@ -46,14 +51,13 @@ def box1(fun, initialLower, initialUpper):
     Use for keyshape: (population_size, parameter_keys + two_bounds_keys)
     where the second dimension has lower and upper bounds keys
     prepended to the parameters keys.
+    The functions accept a single random key or a batch of random keys.
     """
     initialWidth = initialUpper - initialLower
     #----
     def bounds(keys):
-        lowerKey = keys[0]
-        upperKey = keys[1]
-        if lowerKey > upperKey:
-            lowerKey,upperKey = upperKey,lowerKey
+        lowerKey = torch.min(keys[...,0:1], keys[...,1:2])
+        upperKey = torch.max(keys[...,0:1], keys[...,1:2])
         lower = (lowerKey * initialWidth) + initialLower
         upper = (upperKey * initialWidth) + initialLower
         return lower,upper
@@ -62,7 +66,7 @@ def box1(fun, initialLower, initialUpper):
         lower,upper = bounds(keys)
         width = upper - lower
         #---
-        return (keys[2:] * width) + lower
+        return (keys[...,2:] * width) + lower
     #----
     def evaluate(keys):
         return fun(decode(keys))
@@ -76,17 +80,18 @@ def box2(fun, initialLower, initialUpper):
     where the first parameter dimension is two rows of lower and upper bounds keys,
     and one row of parameters keys.
     The bounds are learned, two per parameter.
+    The functions accept a single random key or a batch of random keys.
     """
     #----
     def bounds(keys):
-        lowers = initialLower + (3.0 * keys[0])
-        uppers = initialUpper - (3.0 * keys[1])
+        lowers = initialLower + (3.0 * keys[...,0,:])
+        uppers = initialUpper - (3.0 * keys[...,1,:])
         return lowers,uppers
     #----
     def decode(keys):
         lowers,uppers = bounds(keys)
         widths = uppers - lowers
-        return (keys[2] * widths) + lowers
+        return (keys[...,2,:] * widths) + lowers
     #----
     def evaluate(keys):
         return fun(decode(keys))
@@ -100,13 +105,14 @@ def box3(fun, initialLower, initialUpper):
     where the first parameter dimension is two rows of lower and upper bounds keys,
     and one row of parameters keys.
     The bounds are learned, two per parameter.
+    The functions accept a single random key or a batch of random keys.
     """
     initialWidth = initialUpper - initialLower
     #----
     def bounds(keys):
-        v,_ = keys[:2].sort(-2)
-        lowerKeys = v[0]
-        upperKeys = v[1]
+        v,_ = keys[...,:2,:].sort(-2)
+        lowerKeys = v[...,0,:]
+        upperKeys = v[...,1,:]
         lowers = (lowerKeys * initialWidth) + initialLower
         uppers = (upperKeys * initialWidth) + initialLower
         return lowers,uppers
@@ -114,7 +120,7 @@ def box3(fun, initialLower, initialUpper):
     def decode(keys):
         lowers,uppers = bounds(keys)
         widths = uppers - lowers
-        valueKeys = keys[2]
+        valueKeys = keys[...,2,:]
         return (valueKeys * widths) + lowers
     #----
     def evaluate(keys):
@@ -123,70 +129,36 @@ def box3(fun, initialLower, initialUpper):
     return bounds,decode,evaluate
 
 
-def Optimize(box, keyShape, elites=2, mutants=2):
+def Optimize(box, keyShape, elites=2, mutants=2, optimizer=optSGD(), **kwargs):
     """
     Minimize the HappyCat function in the interval (-2,+2).
+    The keyword arguments are passed to 'brkga.run', e.g. 'maxTime' or 'stagnation'.
     """
-    trial = 0
     bounds,decode,f = box  #box3(HappyCat, -2.0, 2.0)
-    pop = BRKGA(keyShape, elites=elites, mutants=mutants)
-    results = pop.map(f)
-    bestResult,best = pop.orderBy(results)
-    print(f"[{trial:6d}] {bestResult:.8f}")
-    print(decode(best.data))
-    try:
-        while bestResult > 1.0e-7:
-            trial += 1
-            pop.evolve()
-            results = pop.map(f)
-            bestResult,best = pop.orderBy(results)
-            if trial % 100 == 0:
-                print(f"[{trial:6d}] {bestResult:.8f}")
-                print(decode(best.data))
-    except KeyboardInterrupt:
-        pass
-    finally:
-        print(f"[{trial:6d}] {bestResult:.8f}")
-        print(f"BRKGA keys=\n{best.data}")
-        hcLower,hcUpper = bounds(best.data)
-        print(f"HappyCat Bounds: lower:{hcLower} upper:{hcUpper}")
-        print(f"HappyCat parameters=\n{decode(best.data)}")
-    return bestResult,best
-
-
-
-
-def OptimizeGrad(box, keyShape, elites=2, mutants=2, lr=0.001):
+    pop = BRKGA(keyShape, elites=elites, mutants=mutants, optimizer=optimizer)
+    #----
+    def report(state):
+        print(f"[{state.generations:6d}] {state.bestResult:.8f}")
+        print(decode(state.best))
+    #----
+    state = run(pop, f, target=1.0e-7, callback=report, **kwargs)
+    print(f"[{state.generations:6d}] {state.bestResult:.8f} ({state.reason})")
+    print(f"BRKGA keys=\n{state.best}")
+    hcLower,hcUpper = bounds(state.best)
+    print(f"HappyCat Bounds: lower:{hcLower} upper:{hcUpper}")
+    print(f"HappyCat parameters=\n{decode(state.best)}")
+    return state.bestResult,state.best
+
+
+
+
+def OptimizeGrad(box, keyShape, elites=2, mutants=2, lr=0.001, **kwargs):
     """
     Minimize the HappyCat function in the interval (-2,+2).
     This function uses gradient information to improve the evolved solutions.
+    The keyword arguments are passed to 'brkga.run', e.g. 'maxTime' or 'stagnation'.
     """
-    trial = 0
-    bounds,decode,f = box
-    pop = BRKGA(keyShape, elites=elites, mutants=mutants, optimizer=optAdam(lr=lr))
-    try:
-        results = pop.map(f)
-        bestResult,best = pop.orderBy(results)
-        while bestResult > 1.0e-7:
-            if trial % 100 == 0:
-                print(f"[{trial:6d}] {bestResult:.8f}")
-                print(decode(best.data))
-            trial += 1
-            pop.evolve()
-            results = pop.map(f)
-            results.mean().backward()
-            pop.optimize()
-            results = pop.map(f)
-            bestResult,best = pop.orderBy(results)
-    except KeyboardInterrupt:
-        pass
-    finally:
-        print(f"[{trial:6d}] {bestResult:.8f}")
-        print(f"BRKGA keys=\n{best.data}")
-        hcLower,hcUpper = bounds(best.data)
-        print(f"HappyCat Bounds: lower:{hcLower} upper:{hcUpper}")
-        print(f"HappyCat parameters=\n{decode(best.data)}")
-    return bestResult,best
+    return Optimize(box, keyShape, elites=elites, mutants=mutants, optimizer=optAdam(lr=lr), grad=True, **kwargs)
 
 
 
@@ -0,0 +1,176 @@
+"""
+File: islands.py
+
+Description:
+
+An island model for the "Biased Random-Key Genetic Algorithm".
+
+Several independent BRKGA populations evolve in parallel worker processes,
+and every few generations each island sends copies of its best random keys
+to its neighbouring islands, where they replace the worst random keys.
+
+"""
+
+import torch
+from brkga import BRKGA,multiprocessingContext,childSeeds
+
+
+def ringTopology(islands):
+    """
+    Each island receives the emigrants of the previous island.
+    """
+    return [[(i - 1) % islands] for i in range(islands)]
+
+
+def fullTopology(islands):
+    """
+    Each island receives the emigrants of every other island.
+    """
+    return [[j for j in range(islands) if j != i] for i in range(islands)]
+
+
+topologies = {'ring':ringTopology, 'full':fullTopology}
+
+
+
+def _island(conn, func, populationShape, seed, batched, descending, kwargs):
+    """
+    The worker process of one island.
+    Requests from the parent process:
+        ('evolve', generations, migrants, immigrantKeys, immigrantResults)
+        ('close',)
+    """
+    torch.set_num_threads(1)
+    torch.manual_seed(seed)
+    pop = BRKGA(populationShape, seed=seed, **kwargs)
+    mapf = pop.mapBatch if batched else pop.map
+    bestResult,best = pop.orderBy(mapf(func), descending=descending)
+    while True:
+        request = conn.recv()
+        if request[0] == 'close':
+            break
+        _,generations,migrants,immigrantKeys,immigrantResults = request
+        if immigrantKeys is not None:
+            bestResult,best = pop.immigrate(immigrantKeys, immigrantResults)
+        for _ in range(generations):
+            pop.evolve()
+            bestResult,best = pop.orderBy(mapf(func), descending=descending)
+        emigrants = pop.indexes[:migrants]
+        conn.send((bestResult.item(),
+                   best.detach().clone(),
+                   pop.keys[emigrants].detach().clone(),
+                   pop.fitness[emigrants].clone()))
+    conn.close()
+
+
+
+class Islands():
+    """
+    Evolve 'islands' independent BRKGA populations of shape 'populationShape'
+    in parallel worker processes, one process per island.
+    Every 'interval' generations the best 'migrants' random keys of each island
+    migrate to the islands connected by 'topology', which is 'ring', 'full',
+    or a list with the list of source islands for each island.
+    'func' is the objective function, applied with 'BRKGA.mapBatch' if 'batched'
+    is True, otherwise with 'BRKGA.map'.
+    The remaining keyword arguments are passed to each BRKGA constructor.
+    Each island has an independent random number stream derived from 'seed'.
+    'context' is a multiprocessing context or start method name,
+    see 'brkga.multiprocessingContext'.
+    """
+    def __init__(self, func, populationShape, islands=4, migrants=1, interval=100, topology='ring',
+                    batched=False, descending=False, seed=None, context=None, **kwargs):
+        self.islandCount = islands
+        self.migrants = max(1, migrants)
+        self.interval = max(1, interval)
+        self.topology = topologies[topology](islands) if isinstance(topology, str) else topology
+        self.descending = descending
+        self.generation = 0
+        #----
+        if seed is None:
+            seed = torch.randint(2**62, ()).item()
+        seeds = childSeeds(torch.Generator().manual_seed(seed), islands)
+        context = multiprocessingContext(context)
+        self.connections = []
+        self.processes = []
+        for i in range(islands):
+            parent,child = context.Pipe()
+            process = context.Process(target=_island,
+                                      args=(child, func, populationShape, seeds[i], batched, descending, kwargs),
+                                      daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        #----
+        self.immigrants = [(None,None)] * islands
+        self.results = [None] * islands
+        self.bests = [None] * islands
+        self.bestResult = None
+        self.best = None
+    #------------------------------------------------------
+    def _better(self, a, b):
+        return a > b if self.descending else a < b
+    #------------------------------------------------------
+    def epoch(self):
+        """
+        Evolve every island for 'self.interval' generations, in parallel,
+        then collect the emigrants for the next epoch.
+        The best result and random key over all islands are returned.
+        """
+        for conn,(keys,results) in zip(self.connections, self.immigrants):
+            conn.send(('evolve', self.interval, self.migrants, keys, results))
+        emigrants = []
+        for i,conn in enumerate(self.connections):
+            self.results[i],self.bests[i],keys,results = conn.recv()
+            emigrants.append((keys,results))
+            if self.bestResult is None or self._better(self.results[i], self.bestResult):
+                self.bestResult,self.best = self.results[i],self.bests[i]
+        self.generation += self.interval
+        #----
+        self.immigrants = [(torch.cat([emigrants[j][0] for j in sources]),
+                            torch.cat([emigrants[j][1] for j in sources]))
+                                if sources else (None,None)
+                                    for sources in self.topology]
+        return self.bestResult,self.best
+    #------------------------------------------------------
+    def run(self, epochs):
+        """
+        Evolve the islands for 'epochs' migration intervals.
+        The best result and random key over all islands are returned.
+        """
+        for _ in range(epochs):
+            self.epoch()
+        return self.bestResult,self.best
+    #------------------------------------------------------
+    def close(self):
+        """
+        Stop the island worker processes.
+        """
+        for conn in self.connections:
+            conn.send(('close',))
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+    #------------------------------------------------------
+    def __enter__(self):
+        return self
+    #------------------------------------------------------
+    def __exit__(self, *args):
+        self.close()
+
+
+
+
+
+##===================================================
+
+if __name__ == '__main__':
+    from sphere import Sphere,box
+    bounds,decode,f = box(Sphere, -50, 50)
+    with Islands(f, (15,100), islands=4, migrants=2, interval=100, batched=True, elites=2, mutants=2) as islands:
+        for epoch in range(100):
+            bestResult,best = islands.epoch()
+            print(f"[{islands.generation:6d}] {bestResult:.8f}  {[round(r, 8) for r in islands.results]}")
@@ -13,11 +13,15 @@ See: https://en.wikipedia.org/wiki/Test_functions_for_optimization
 """
 
 import torch
-from brkga import BRKGA
+from brkga import BRKGA,run
 
 
 def Sphere(x):
-    return x.dot(x)
+    """
+    'x' is a single parameter vector, or a batch of parameter vectors
+    with shape (rows, parameters) which gives one result per row.
+    """
+    return x.mul(x).sum(-1)
 
 
 def box(fun, lower, upper):
@@ -25,6 +29,7 @@ def box(fun, lower, upper):
     1 dimension per population member.
     Keyshape: (population size, parameter keys)
     Parameter keys only.
+    The functions accept a single random key or a batch of random keys.
     """
     width = upper - lower
     #----
@@ -40,63 +45,33 @@ def box(fun, lower, upper):
     return bounds,decode,evaluate
 
 
-def Optimize(keyShape, elites=2, mutants=2):
+def Optimize(keyShape, elites=2, mutants=2, **kwargs):
     """
     Minimize the Sphere function in the interval (-50,+50).
+    The keyword arguments are passed to 'brkga.run', e.g. 'maxTime' or 'stagnation'.
     """
-    trial = 0
     bounds,decode,f = box(Sphere, -50, 50)
     pop = BRKGA(keyShape, elites=elites, mutants=mutants)
-    results = pop.map(f)
-    bestResult,best = pop.orderBy(results)
-    print(f"[{trial:6d}] {bestResult:.8f}")
-    print(decode(best.data))
-    try:
-        while bestResult > 1.0e-7:
-            trial += 1
-            pop.evolve()
-            results = pop.map(f)
-            bestResult,best = pop.orderBy(results)
-            if trial % 100 == 0:
-                print(f"[{trial:6d}] {bestResult:.8f}")
-                print(decode(best.data))
-    except KeyboardInterrupt:
-        pass
-    finally:
-        print(f"[{trial:6d}] {bestResult:.8f}")
-        print(f"BRKGA keys=\n{best.data}")
-        print(f"Sphere parameters=\n{decode(best.data)}")
-    return bestResult,best
-
-
-def OptimizeSGD(keyShape, elites=2, mutants=2):
+    #----
+    def report(state):
+        print(f"[{state.generations:6d}] {state.bestResult:.8f}")
+        print(decode(state.best))
+    #----
+    state = run(pop, f, target=1.0e-7, callback=report, **kwargs)
+    print(f"[{state.generations:6d}] {state.bestResult:.8f} ({state.reason})")
+    print(f"BRKGA keys=\n{state.best}")
+    print(f"Sphere parameters=\n{decode(state.best)}")
+    return state.bestResult,state.best
+
+
+def OptimizeSGD(keyShape, elites=2, mutants=2, **kwargs):
     """
     Minimize the Sphere function in the interval (-50,+50).
     This function uses gradient information to improve the evolved solutions.
+    The keyword arguments are passed to 'brkga.run', e.g. 'maxTime' or 'stagnation'.
     """
-    trial = 0
-    bounds,decode,f = box(Sphere, -50, 50)
-    pop = BRKGA(keyShape, elites=elites, mutants=mutants)
-    bestResult,best = pop.orderBy(pop.map(f))
-    print(f"[{trial:6d}] {bestResult:.8f}")
-    print(decode(best.data))
-    try:
-        while bestResult > 1.0e-7:
-            trial += 1
-            pop.evolve()
-            pop.map(f).mean().backward()
-            pop.optimize()  # uses default SGD optimizer with lr=1.0e-3
-            bestResult,best = pop.orderBy(pop.map(f))
-            if trial % 100 == 0:
-                print(f"[{trial:6d}] {bestResult:.8f}")
-                print(decode(best.data))
-    except KeyboardInterrupt:
-        pass
-    finally:
-        print(f"[{trial:6d}] {bestResult:.8f}")
-        print(f"BRKGA keys=\n{best.data}")
-        print(f"Sphere parameters=\n{decode(best.data)}")
-    return bestResult,best
+    # uses default SGD optimizer with lr=1.0e-3
+    return Optimize(keyShape, elites=elites, mutants=mutants, grad=True, **kwargs)
 
         
 